@@ -0,0 +1,72 @@
+"""
+Flood solver benchmark
+=======================
+
+Compares the run times of `FrExWaterGrid.solve_flood` and step-by-step simulation,
+the agreement of both is tested in tests/test_flood_solver.py.
+
+    python -m benchmarks.flood_solver [--sizes 16 32 64] [--seeds 5] [--no-jit]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from flood.maps import FrExWaterGrid, generate_terrain
+
+
+def make_grid(size, seed, jit):
+    shape = (size, size)
+    grid = FrExWaterGrid(shape=shape, depth_first_factor=5, verbose=False, jit=jit, seed=seed)
+    grid.set_terrain(*generate_terrain(shape, 8, "perlin", cave=0.3, extra_cave=0.2, seed=seed, compact=True))
+    floor = np.argwhere(~grid.walls)
+    for i in np.random.default_rng(seed).choice(len(floor), size=2, replace=False):
+        grid.add_source(tuple(int(c) for c in floor[i]))
+    return grid
+
+
+def simulate(grid):
+    """
+    Step until the frontier is empty, recording the round each cell first got water
+    """
+    arrival = np.full(grid.shape, np.inf)
+    arrival[grid.water_grid > 0] = grid.round
+    r = grid.round
+    while grid.frontier_size:
+        r += 1
+        grid.step_update(r, None)
+        arrival[(grid.water_grid > 0) & np.isinf(arrival)] = r
+    arrival[grid.walls] = np.nan
+    return arrival, np.where(grid.walls, np.nan, grid.water_grid.astype(int) + grid.terrain_grid)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--seeds", type=int, default=5)
+    parser.add_argument("--no-jit", action="store_true")
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'seed':>5} {'solver':>10} {'simulation':>12} {'rounds':>7} match")
+    for size in args.sizes:
+        for seed in range(args.seeds):
+            grid = make_grid(size, seed, not args.no_jit)
+            grid.fast_forward(seed * 10)
+            start = time.perf_counter()
+            arrival, level = grid.solve_flood()
+            solver = time.perf_counter() - start
+            start = time.perf_counter()
+            expected_arrival, expected_level = simulate(grid)
+            simulation = time.perf_counter() - start
+            match = (
+                np.array_equal(arrival, expected_arrival, equal_nan=True)
+                and np.array_equal(level, expected_level, equal_nan=True)
+            )
+            print(
+                f"{size:>5}x{size:<4} {seed:>5} {solver*1000:>8.2f}ms {simulation*1000:>10.2f}ms "
+                f"{int(np.nanmax(arrival[np.isfinite(arrival)], initial=0)):>7} {'ok' if match else 'MISMATCH'}"
+            )
+
+
+if __name__ == "__main__":
+    main()
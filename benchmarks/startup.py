@@ -0,0 +1,78 @@
+"""
+Startup benchmark
+==================
+
+Measures, each in a fresh interpreter, the time to import `flood`,
+to build a headless simulation, to import `Game` and to construct `Game`
+(the last one needs a display).
+
+    python -m benchmarks.startup [--repeat 5] [--config settings.yml]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+CASES = {
+    "import flood": (
+        "import flood"
+    ),
+    "headless grid": (
+        "from flood.maps import FrExWaterGrid, generate_terrain\n"
+        "grid = FrExWaterGrid(shape=(80, 64), depth_first_factor=5)\n"
+        "grid.set_terrain(generate_terrain((80, 64), 8, 'perlin', 0.4, 0.3, seed=0))\n"
+        "grid.add_source((10, 20))"
+    ),
+    "import Game": (
+        "from flood import Game"
+    ),
+    "Game(...)": (
+        "from flood import Game\n"
+        "Game({config!r})"
+    ),
+}
+
+TEMPLATE = """
+import json, sys, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+heavy = sorted({{m.split('.')[0] for m in sys.modules}} & {{'pygame', 'OpenGL', 'ruamel', 'torch'}})
+print(json.dumps([elapsed, heavy]))
+"""
+
+
+def run_case(code):
+    result = subprocess.run(
+        [sys.executable, "-c", TEMPLATE.format(code=code)],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--config", default="settings.yml")
+    args = parser.parse_args()
+
+    print(f"{'case':<16} {'best':>10} {'modules loaded'}")
+    for name, code in CASES.items():
+        code = code.format(config=args.config)
+        times = []
+        for _ in range(args.repeat):
+            elapsed, heavy = run_case(code)
+            if elapsed is None:
+                break
+            times.append(elapsed)
+        if not times:
+            print(f"{name:<16} {'failed':>10} {heavy}")
+            continue
+        print(f"{name:<16} {min(times)*1000:>8.1f}ms {', '.join(heavy) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
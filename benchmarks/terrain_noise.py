@@ -0,0 +1,69 @@
+"""
+Terrain noise benchmark
+========================
+
+Compares the vectorized numpy noise used by `generate_terrain`
+with the former per-cell `perlin_noise.PerlinNoise` path.
+
+    python -m benchmarks.terrain_noise [--sizes 64 256 1024] [--per-cell-max 1024]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from flood.maps.utils import fractal_noise
+
+
+def per_cell_noise(shape):
+    from perlin_noise import PerlinNoise
+    noise_gen = PerlinNoise(octaves=8)
+    return np.reshape([
+        noise_gen([x/shape[0], y/shape[1]])
+        for (x, y)
+        in np.ndindex(shape)
+    ], shape)
+
+
+def vectorized_noise(shape):
+    return fractal_noise(shape, frequency=8, seed=0)
+
+
+def measure(func, shape, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(shape)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 256, 1024])
+    parser.add_argument("--per-cell-max", type=int, default=1024, help="Skip the per-cell path above this size")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    try:
+        import perlin_noise
+    except ImportError:
+        perlin_noise = None
+        print("perlin_noise is not installed, skipping the per-cell path")
+
+    print(f"{'size':>10} {'vectorized':>12} {'per-cell':>12} {'speedup':>10}")
+    for size in args.sizes:
+        shape = (size, size)
+        vectorized = measure(vectorized_noise, shape, args.repeat)
+        if perlin_noise is not None and size <= args.per_cell_max:
+            per_cell = measure(per_cell_noise, shape, 1)
+            print(
+                f"{size:>5}x{size:<4} {vectorized*1000:>10.2f}ms {per_cell*1000:>10.0f}ms "
+                f"{per_cell/vectorized:>9.0f}x"
+            )
+        else:
+            print(f"{size:>5}x{size:<4} {vectorized*1000:>10.2f}ms {'-':>12} {'-':>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,19 @@
-from .game import Game
+import importlib
+
 from . import maps
-from . import renderer
 
 __all__ = [
     "Game",
     "maps",
     "renderer"
 ]
+
+
+def __getattr__(name):
+    # Game and renderer need pygame and OpenGL, load them on first use only
+    if name == "Game":
+        from .game import Game
+        return Game
+    if name in ("renderer", "controls"):
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class Camera:
+    """
+    Camera
+    =======
+
+    Follows a target with a dead zone: the target moves freely inside a box around the center
+    of the view, `dead_zone` times the size of the view, and the view scrolls only to keep it in the box.
+    The view stays inside the map, a map smaller than the view is centered.
+    Coordinates are cells, (row, column) like the grid.
+    """
+    min_zoom = 0.25
+    max_zoom = 4
+
+    def __init__(self, extent, map_size, dead_zone=0.5, zoom=1.0, margin=2):
+        """
+        :param extent: Number of cells the view spans at zoom 1, (rows, columns)
+        :param map_size: Grid shape
+        :param dead_zone: Fraction of the view the target moves in without scrolling
+        :param zoom: Scale factor, 2 shows half as many cells per side
+        :param margin: Cells beyond the view edges that `visible` includes
+        """
+        self.base_extent = np.asarray(extent, dtype=float)
+        self.map_size = np.asarray(map_size, dtype=float)
+        self.dead_zone = dead_zone
+        self.zoom = zoom
+        self.margin = margin
+        self.center = self.extent / 2
+
+    @property
+    def extent(self):
+        return self.base_extent / self.zoom
+
+    @property
+    def origin(self):
+        """
+        Top left corner of the view in cells, fractional
+        """
+        return self.center - self.extent / 2
+
+    def set_zoom(self, zoom):
+        self.zoom = min(max(zoom, self.min_zoom), self.max_zoom)
+        self._clamp()
+
+    def look_at(self, coords):
+        """
+        Center the view on a cell
+        """
+        self.center = np.asarray(coords, dtype=float) + 0.5
+        self._clamp()
+
+    def follow(self, coords):
+        """
+        Scroll just enough to bring a cell inside the dead zone
+        """
+        half = self.extent * self.dead_zone / 2
+        offset = np.asarray(coords, dtype=float) + 0.5 - self.center
+        self.center = self.center + offset - np.clip(offset, -half, half)
+        self._clamp()
+
+    def visible(self):
+        """
+        Cells inside the view grown by `margin`, clipped to the map
+        :return: (first row, first column, stop row, stop column)
+        """
+        start = np.clip(np.floor(self.origin).astype(int) - self.margin, 0, self.map_size.astype(int))
+        stop = np.clip(np.ceil(self.origin + self.extent).astype(int) + self.margin, 0, self.map_size.astype(int))
+        return (*start.tolist(), *stop.tolist())
+
+    def _clamp(self):
+        half = self.extent / 2
+        self.center = np.where(
+            self.extent >= self.map_size,
+            self.map_size / 2,
+            np.clip(self.center, half, self.map_size - half)
+        )
@@ -0,0 +1,91 @@
+"""
+Command console
+================
+
+Reads command lines from stdin and from clients of a local Unix socket on background threads
+and queues them, the game executes them between frames. Every command gets a text reply,
+printed for stdin and sent back for socket clients, ended by an empty line.
+The game loop never waits for input.
+
+    $ socat - UNIX-CONNECT:.flood.sock
+    rounds 1000
+"""
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+from typing import Callable, NamedTuple
+
+
+class Command(NamedTuple):
+    line: str
+    # Called with the reply text
+    reply: Callable
+
+
+class Console:
+    def __init__(self, stdin=True, socket_path=None):
+        """
+        :param stdin: Read commands from stdin
+        :param socket_path: Path of a Unix socket to accept commands on, None for no socket
+        """
+        self.commands = queue.Queue()
+        self.socket_path = None
+        self._server = None
+        if stdin:
+            threading.Thread(target=self._read_stdin, name="console stdin", daemon=True).start()
+        if socket_path is not None and hasattr(socket, "AF_UNIX"):
+            self._serve(socket_path)
+
+    def pending(self):
+        """
+        Take the queued commands without waiting
+        """
+        while True:
+            try:
+                yield self.commands.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            os.remove(self.socket_path)
+            self._server = None
+
+    def _read_stdin(self):
+        for line in sys.stdin:
+            if line.strip():
+                self.commands.put(Command(line.strip(), lambda text: print(text, flush=True)))
+
+    def _serve(self, socket_path):
+        commands = self.commands
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                replies = queue.Queue()
+                for line in self.rfile:
+                    line = line.decode(errors="replace").strip()
+                    if not line:
+                        continue
+                    commands.put(Command(line, replies.put))
+                    # an empty line ends each reply
+                    self.wfile.write((replies.get() + "\n\n").encode())
+
+        if os.path.exists(socket_path):
+            with socket.socket(socket.AF_UNIX) as probe:
+                try:
+                    probe.connect(socket_path)
+                except OSError:
+                    # left behind by a game that did not exit cleanly
+                    os.remove(socket_path)
+                else:
+                    print(f"Console socket {socket_path} is used by another game", file=sys.stderr)
+                    return
+        self.socket_path = socket_path
+        self._server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="console socket", daemon=True).start()
@@ -1,5 +1,16 @@
-from .pg_keyboard import PyGameKeyboard
+from .recording import Recording, RecordingController, ReplayController
 
 __all__ = [
-    "PyGameKeyboard"
+    "PyGameKeyboard",
+    "Recording",
+    "RecordingController",
+    "ReplayController",
 ]
+
+
+def __getattr__(name):
+    # PyGameKeyboard needs pygame, load it on first use only
+    if name == "PyGameKeyboard":
+        from .pg_keyboard import PyGameKeyboard
+        return PyGameKeyboard
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
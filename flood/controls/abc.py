@@ -2,6 +2,18 @@ import abc
 
 
 class ControllerABC(abc.ABC):
+    # Real-time controllers are polled every frame, the others supply a round per call,
+    # which the game plays as fast as it can
+    realtime = True
+
     @abc.abstractmethod
     def get_events(self):
         pass
+
+    def round_played(self, r, events):
+        """
+        Called after every round with the in-game events it was played with
+        :param r: Round number
+        :param events: Set of GameEvent ids
+        """
+        pass
@@ -18,6 +18,11 @@ class PyGameKeyboard(ControllerABC):
         pg.K_ESCAPE: GameEvent["game.quit"],
         pg.K_SEMICOLON: GameEvent["game.command"],
         pg.K_1: GameEvent["game.autoplay"],
+        pg.K_F3: GameEvent["game.metrics"],
+        pg.K_EQUALS: GameEvent["game.zoom_in"],
+        pg.K_KP_PLUS: GameEvent["game.zoom_in"],
+        pg.K_MINUS: GameEvent["game.zoom_out"],
+        pg.K_KP_MINUS: GameEvent["game.zoom_out"],
     }
 
     def get_events(self):
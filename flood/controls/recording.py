@@ -0,0 +1,79 @@
+import numpy as np
+
+from .abc import ControllerABC
+from .. import snapshot
+from ..event import GameEvent, MetaEvents
+
+
+class Recording:
+    """
+    Recording
+    ==========
+
+    Seed of a session and the in-game events of every round, one bitmask of GameEvent ids per round.
+    Stored as a snapshot file.
+    """
+    def __init__(self, seed, rounds=None):
+        self.seed = seed
+        self.rounds = [] if rounds is None else [int(mask) for mask in rounds]
+
+    def __len__(self):
+        return len(self.rounds)
+
+    def append(self, events):
+        self.rounds.append(sum(1 << event for event in events if event not in MetaEvents))
+
+    def events(self, i):
+        """
+        :return: Set of GameEvent ids of the i-th round
+        """
+        return {event for event in GameEvent.values() if self.rounds[i] >> event & 1}
+
+    def save(self, path):
+        snapshot.write_snapshot(
+            path,
+            {"kind": "recording", "seed": self.seed},
+            {"rounds": np.array(self.rounds, dtype=np.uint16)}
+        )
+
+    @classmethod
+    def load(cls, path):
+        meta, arrays = snapshot.read_snapshot(path, mmap=False)
+        if meta.get("kind") != "recording":
+            raise ValueError(f"{path} is not a recording")
+        return cls(meta["seed"], arrays["rounds"].tolist())
+
+
+class RecordingController(ControllerABC):
+    """
+    Passes on the events of another controller and records every round played with them
+    """
+    def __init__(self, controller, recording):
+        self.controller = controller
+        self.recording = recording
+        self.realtime = controller.realtime
+
+    def get_events(self):
+        return self.controller.get_events()
+
+    def round_played(self, r, events):
+        self.recording.append(events)
+        self.controller.round_played(r, events)
+
+
+class ReplayController(ControllerABC):
+    """
+    Plays a recording back, one round per call, then quits
+    """
+    realtime = False
+
+    def __init__(self, recording):
+        self.recording = recording
+        self.position = 0
+
+    def get_events(self):
+        if self.position >= len(self.recording):
+            return {GameEvent["game.quit"]}
+        events = self.recording.events(self.position)
+        self.position += 1
+        return events
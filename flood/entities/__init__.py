@@ -1,5 +1,11 @@
 from .player import Player
+from .store import EntityStore, SpatialIndex, WET, COLD, FATIGUED
 
 __all__ = [
-    "Player"
+    "Player",
+    "EntityStore",
+    "SpatialIndex",
+    "WET",
+    "COLD",
+    "FATIGUED"
 ]
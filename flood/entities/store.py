@@ -0,0 +1,304 @@
+import numpy as np
+
+from ..abc import DrawableABC
+from ..geometry import Npc
+from .abc import EntityABC
+
+# Status flags
+WET = 1
+COLD = 2
+FATIGUED = 4
+
+
+class SpatialIndex:
+    """
+    Spatial Index
+    ==============
+
+    Uniform grid of `bucket` x `bucket` cell buckets over entity positions. Entities are sorted by
+    (bucket, cell), so the entities of a bucket are one slice and those of a cell a run within it.
+    Rebuilt in one sort per round, queries for many cells run at once.
+    """
+    def __init__(self, shape, bucket=8):
+        self.shape = tuple(shape)
+        self.bucket = bucket
+        self.buckets_shape = tuple(-(-size // bucket) for size in self.shape)
+        self.n_cells = self.shape[0] * self.shape[1]
+        self.ids = np.zeros(0, dtype=np.intp)
+        self._keys = np.zeros(0, dtype=np.int64)
+
+    def _key(self, rows, cols):
+        bucket = (rows // self.bucket) * self.buckets_shape[1] + cols // self.bucket
+        return bucket.astype(np.int64) * self.n_cells + rows * self.shape[1] + cols
+
+    def rebuild(self, ids, positions):
+        """
+        :param ids: Entity ids
+        :param positions: Integer array of shape (n, 2), (row, column) cells inside the map
+        """
+        keys = self._key(positions[:, 0], positions[:, 1])
+        order = np.argsort(keys, kind="stable")
+        self.ids = np.asarray(ids)[order]
+        self._keys = keys[order]
+
+    def count(self, cells):
+        """
+        Number of entities on each cell
+        :param cells: Integer array of shape (n, 2)
+        :return: int array of shape (n,), 0 outside the map
+        """
+        cells = np.asarray(cells, dtype=np.intp).reshape(-1, 2)
+        rows, cols = cells[:, 0], cells[:, 1]
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        keys = self._key(np.where(inside, rows, 0), np.where(inside, cols, 0))
+        counts = np.searchsorted(self._keys, keys, side="right") - np.searchsorted(self._keys, keys)
+        return np.where(inside, counts, 0)
+
+    def occupancy(self):
+        """
+        Number of entities per bucket
+        :return: int array of shape `buckets_shape`
+        """
+        counts = np.bincount(self._keys // self.n_cells, minlength=self.buckets_shape[0] * self.buckets_shape[1])
+        return counts.reshape(self.buckets_shape)
+
+    def query(self, view):
+        """
+        Entities inside a rectangle
+        :param view: (first row, first column, stop row, stop column)
+        :return: Entity ids
+        """
+        row0, col0, row1, col1 = (max(int(x), 0) for x in view)
+        row1, col1 = min(row1, self.shape[0]), min(col1, self.shape[1])
+        if row0 >= row1 or col0 >= col1:
+            return np.zeros(0, dtype=np.intp)
+        bucket_rows = np.arange(row0 // self.bucket, -(-row1 // self.bucket))
+        bucket_cols = np.arange(col0 // self.bucket, -(-col1 // self.bucket))
+        buckets = (bucket_rows[:, None] * self.buckets_shape[1] + bucket_cols).reshape(-1).astype(np.int64)
+        starts = np.searchsorted(self._keys, buckets * self.n_cells)
+        stops = np.searchsorted(self._keys, (buckets + 1) * self.n_cells)
+        slots = np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)])
+        cells = self._keys[slots] % self.n_cells
+        rows, cols = cells // self.shape[1], cells % self.shape[1]
+        inside = (rows >= row0) & (rows < row1) & (cols >= col0) & (cols < col1)
+        return self.ids[slots[inside]]
+
+    def collisions(self):
+        """
+        Entities that share their cell with another entity
+        :return: Entity ids
+        """
+        shared = np.zeros(len(self._keys), dtype=bool)
+        same = self._keys[1:] == self._keys[:-1]
+        shared[1:] |= same
+        shared[:-1] |= same
+        return self.ids[shared]
+
+
+class EntityStore(EntityABC, DrawableABC):
+    """
+    Entity Store
+    =============
+
+    Many simple entities as a struct of arrays: positions (row, column), kinds, health
+    and status flags (WET, COLD, FATIGUED), indexed by entity id. Ids of removed entities are reused.
+    Rounds update all entities at once:
+    - wet: standing in water, cold: wet for `cold_after` rounds, until dry for as many rounds,
+    - fatigued: after `fatigue_after` moves through water of `wade_level` or more, until rested for as many
+      rounds; fatigued entities move every other round,
+    - health drops by `drown_damage` in water of `drown_level` or more and by `cold_damage` while cold,
+      entities without health are removed.
+    Entities move down a DistanceField, onto cells free at the start of the round; when several
+    entities head for the same cell the lowest id gets it. `index` is a SpatialIndex of the entities.
+    All entities are drawn in a single draw call. Special entities can still be EntityABC objects.
+    """
+    def __init__(
+        self,
+        shape,
+        capacity=64,
+        bucket=8,
+        cold_after=10,
+        fatigue_after=5,
+        wade_level=2,
+        drown_level=3,
+        drown_damage=0.2,
+        cold_damage=0.02
+    ):
+        self.shape = tuple(shape)
+        self.cold_after = cold_after
+        self.fatigue_after = fatigue_after
+        self.wade_level = wade_level
+        self.drown_level = drown_level
+        self.drown_damage = drown_damage
+        self.cold_damage = cold_damage
+        self.positions = np.zeros((capacity, 2), dtype=np.intp)
+        self.kinds = np.zeros(capacity, dtype=np.uint8)
+        self.health = np.zeros(capacity, dtype=np.float32)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.alive = np.zeros(capacity, dtype=bool)
+        # Rounds spent wet (counting down while dry), and moves through water (counting down while resting)
+        self.exposure = np.zeros(capacity, dtype=np.int16)
+        self.fatigue = np.zeros(capacity, dtype=np.int16)
+        self.index = SpatialIndex(self.shape, bucket)
+
+    _arrays = ("positions", "kinds", "health", "flags", "alive", "exposure", "fatigue")
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive))
+
+    @property
+    def ids(self):
+        return np.flatnonzero(self.alive)
+
+    def add(self, positions, kind=0, health=1.0):
+        """
+        :param positions: Integer array of shape (n, 2)
+        :param kind: Kind of the new entities, or an array of kinds
+        :param health: Health of the new entities, or an array of health values
+        :return: Ids of the new entities
+        """
+        positions = np.asarray(positions, dtype=np.intp).reshape(-1, 2)
+        free = np.flatnonzero(~self.alive)
+        if len(free) < len(positions):
+            capacity = len(self.alive)
+            new_capacity = max(2 * capacity, capacity - len(free) + len(positions))
+            for name in self._arrays:
+                array = getattr(self, name)
+                grown = np.zeros((new_capacity, *array.shape[1:]), dtype=array.dtype)
+                grown[:capacity] = array
+                setattr(self, name, grown)
+            free = np.flatnonzero(~self.alive)
+        ids = free[:len(positions)]
+        self.positions[ids] = positions
+        self.kinds[ids] = kind
+        self.health[ids] = health
+        self.flags[ids] = 0
+        self.exposure[ids] = 0
+        self.fatigue[ids] = 0
+        self.alive[ids] = True
+        self._reindex()
+        return ids
+
+    def remove(self, ids):
+        self.alive[ids] = False
+        self._reindex()
+
+    def _reindex(self):
+        ids = self.ids
+        self.index.rebuild(ids, self.positions[ids])
+
+    def has(self, ids, flag):
+        """
+        :return: Boolean array, whether the entities have a status flag
+        """
+        return (self.flags[ids] & flag) > 0
+
+    def _set(self, ids, flag, mask):
+        self.flags[ids] = np.where(mask, self.flags[ids] | flag, self.flags[ids] & ~np.uint8(flag))
+
+    def submerge(self, water_grid):
+        """
+        Update the status flags and health from the water on the cells of the entities
+        """
+        ids = self.ids
+        rows, cols = self.positions[ids, 0], self.positions[ids, 1]
+        water = water_grid[rows, cols]
+        wet = water > 0
+        self._set(ids, WET, wet)
+
+        exposure = np.clip(self.exposure[ids] + np.where(wet, 1, -1), 0, self.cold_after)
+        self.exposure[ids] = exposure
+        cold = np.where(exposure == self.cold_after, True, np.where(exposure == 0, False, self.has(ids, COLD)))
+        self._set(ids, COLD, cold)
+
+        damage = np.where(water >= self.drown_level, self.drown_damage, 0) + np.where(cold, self.cold_damage, 0)
+        self.health[ids] -= damage.astype(np.float32)
+        dead = ids[self.health[ids] <= 0]
+        if len(dead):
+            self.remove(dead)
+
+    def move(self, targets, water_grid=None, r=0):
+        """
+        Move all entities towards neighboring cells at once, the others stay
+        :param targets: Integer array of shape (len(self), 2), the cells the entities of `ids` try to move to
+        :param water_grid: Current water levels, for fatigue
+        :param r: Round number, fatigued entities move on even rounds only
+        :return: Ids of the entities that moved
+        """
+        ids = self.ids
+        targets = np.asarray(targets, dtype=np.intp).reshape(-1, 2)
+        moving = np.any(targets != self.positions[ids], axis=1)
+        if r % 2:
+            moving &= ~self.has(ids, FATIGUED)
+        moving &= self.index.count(targets) == 0
+        inside = (targets[:, 0] >= 0) & (targets[:, 0] < self.shape[0]) \
+            & (targets[:, 1] >= 0) & (targets[:, 1] < self.shape[1])
+        moving &= inside
+        # first claimant of each cell
+        claimed = np.flatnonzero(moving)
+        _, first = np.unique(targets[claimed, 0] * self.shape[1] + targets[claimed, 1], return_index=True)
+        moving[:] = False
+        moving[claimed[first]] = True
+
+        if water_grid is not None:
+            rows, cols = np.where(moving[:, None], targets, self.positions[ids]).T
+            wading = moving & (water_grid[rows, cols] >= self.wade_level)
+            fatigue = np.clip(
+                self.fatigue[ids] + np.where(wading, 1, np.where(moving, 0, -1)), 0, self.fatigue_after
+            )
+            self.fatigue[ids] = fatigue
+            fatigued = np.where(
+                fatigue == self.fatigue_after, True, np.where(fatigue == 0, False, self.has(ids, FATIGUED))
+            )
+            self._set(ids, FATIGUED, fatigued)
+
+        self.positions[ids[moving]] = targets[moving]
+        self._reindex()
+        return ids[moving]
+
+    def step_update(self, r, events, water_grid=None, field=None, **kwargs):
+        """
+        :param water_grid: Current water levels
+        :param field: DistanceField to move down (default stay)
+        """
+        if not self.alive.any():
+            return
+        if field is not None:
+            self.move(field.downhill(self.positions[self.ids]), water_grid, r)
+        if water_grid is not None:
+            self.submerge(water_grid)
+
+    def continuous_update(self, t, events, **kwargs):
+        pass
+
+    def draw(self, t, renderer, view=None, **kwargs):
+        """
+        :param view: (first row, first column, stop row, stop column) of the cells to draw (default all)
+        """
+        ids = self.index.query(view if view is not None else (0, 0, *self.shape))
+        if len(ids) == 0:
+            return
+        offsets = self.positions[ids][:, None, :].astype(np.float32)
+        vertices = (offsets + np.asarray(Npc.vertices, dtype=np.float32)).reshape(-1, 2)
+        colors = Npc.colors(health=np.clip(self.health[ids], 0, 1), cold=self.has(ids, COLD))
+        colors = np.repeat(colors.astype(np.float32), len(Npc.vertices), axis=0)
+        renderer.draw_layers(t, {"npc": (vertices, colors)})
+
+    def get_state(self):
+        """
+        :return: (meta, arrays) of the live entities, see FrExWaterGrid.get_state
+        """
+        ids = self.ids
+        arrays = {name: getattr(self, name)[ids] for name in self._arrays if name != "alive"}
+        return {"count": len(ids)}, arrays
+
+    def set_state(self, meta, arrays):
+        for name in self._arrays:
+            array = getattr(self, name)
+            setattr(self, name, np.zeros((0, *array.shape[1:]), dtype=array.dtype))
+        if meta["count"]:
+            ids = self.add(arrays["positions"])
+            for name in self._arrays:
+                if name in arrays:
+                    getattr(self, name)[ids] = arrays[name]
+        self._reindex()
@@ -7,6 +7,9 @@ _event_list = [
     "game.quit",
     "game.command",
     "game.autoplay",
+    "game.metrics",
+    "game.zoom_in",
+    "game.zoom_out",
 ]
 
 
@@ -0,0 +1,224 @@
+"""
+Software framebuffer
+=====================
+
+Rasterizes the grid layers into a NumPy RGB image without a GL context, for screenshots,
+thumbnails and videos from headless runs. Every cell is a `scale` x `scale` block of pixels:
+the sprites are rasterized once into boolean tiles and cell colors come from a lookup table
+over integer levels built from the sprite palettes. Tile pixels covered by the same layers
+share one table lookup over the cells, which is then repeated into each of their pixels.
+The image is in screen orientation, (height, width, 3) with grid rows along the width, like the GL view.
+Blit it with `pg.surfarray.blit_array(surface, image.swapaxes(0, 1))`
+or `glDrawPixels(width, height, GL_RGB, GL_UNSIGNED_BYTE, image[::-1].copy())`, or save it with `write_png`.
+"""
+import struct
+import zlib
+
+import numpy as np
+
+from .geometry import Ground, Player, Water, Wave, WaterSource, floor_mask
+
+
+def rasterize(sprite, scale):
+    """
+    Pixels of a `scale` x `scale` tile covered by a sprite, sampled at pixel centers.
+    Quads are split into two triangles like GL does, lines cover pixels within half a pixel.
+    :return: Boolean array of shape (scale, scale), indexed [y, x]
+    """
+    centers = (np.arange(scale) + 0.5) / scale
+    x, y = np.meshgrid(centers, centers)
+    vertices = np.asarray(sprite.vertices, dtype=float)
+    tile = np.zeros((scale, scale), dtype=bool)
+    if sprite.primitive == "lines":
+        for (x0, y0), (x1, y1) in zip(vertices[::2], vertices[1::2]):
+            dx, dy = x1 - x0, y1 - y0
+            along = np.clip(((x - x0) * dx + (y - y0) * dy) / (dx * dx + dy * dy), 0, 1)
+            distance = np.hypot(x - x0 - along * dx, y - y0 - along * dy) * scale
+            tile |= distance <= 0.5
+        return tile
+    for quad in vertices.reshape(-1, 4, 2):
+        for a, b, c in ((quad[0], quad[1], quad[2]), (quad[0], quad[2], quad[3])):
+            sides = [
+                (q[0] - p[0]) * (y - p[1]) - (q[1] - p[1]) * (x - p[0])
+                for p, q in ((a, b), (b, c), (c, a))
+            ]
+            tile |= np.all([side >= 0 for side in sides], axis=0) | np.all([side <= 0 for side in sides], axis=0)
+    return tile
+
+
+def _lut(colors):
+    return np.round(np.clip(colors, 0, 1) * 255).astype(np.uint8)
+
+
+class FramebufferRenderer:
+    def __init__(self, scale=1):
+        """
+        :param scale: Pixels per cell side
+        """
+        self.scale = scale
+        self.tiles = {
+            name: rasterize(sprite, scale)
+            for name, sprite in (
+                ("ground", Ground),
+                ("water", Water),
+                ("water_wave", Wave),
+                ("water_source", WaterSource),
+                ("player", Player),
+            )
+        }
+        # (palette, offsets) by (terrain levels, water levels)
+        self._palettes = {}
+        # (key, terrain grid, walls, layout) of the last render, see `layout`
+        self._layout = None
+
+    def palette(self, terrain_levels, water_levels):
+        """
+        Colors of all layers in one lookup table, the same as `GridLayers` gives the GL layers:
+        background, ground by terrain level, water by water level, wave by terrain + water level, source
+        :return: (uint8 array of shape (n_colors, 3), dict of the first index of each layer)
+        """
+        key = (terrain_levels, water_levels)
+        if key not in self._palettes:
+            levels = np.arange(256, dtype=np.float32)
+            total_levels = np.arange(511, dtype=np.float32)
+            colors = [
+                np.zeros((1, 3)),
+                Ground.colors(terrain_level=(levels - 1) / terrain_levels),
+                Water.colors(water_level=(levels - 1) / water_levels),
+                Wave.colors(total_level=(total_levels - 1) / (terrain_levels + 2)),
+                WaterSource.colors()[None],
+            ]
+            names = ["background", "ground", "water", "water_wave", "water_source"]
+            offsets = dict(zip(names, np.cumsum([0] + [len(c) for c in colors[:-1]]).tolist()))
+            self._palettes[key] = (_lut(np.concatenate(colors)), offsets)
+        return self._palettes[key]
+
+    def layout(self, terrain_grid, walls, sources, terrain_levels, water_levels, view):
+        """
+        The parts of the image that do not depend on water, cached until the terrain, walls, sources,
+        levels or view change. Per set of tile pixels covered by the same layers: the palette index
+        of dry cells and sources, the layer wet cells show ("water_wave", "water" or None)
+        and whether sources show their water.
+        """
+        key = (terrain_levels, water_levels, tuple(view), frozenset(sources))
+        if self._layout is not None and self._layout[0] == key and self._layout[1] is terrain_grid \
+                and self._layout[2] is walls:
+            return self._layout[3]
+        row0, col0, row1, col1 = view
+        cells = np.s_[row0:row1, col0:col1]
+        # screen orientation, grid rows run along the image width
+        terrain = np.asarray(terrain_grid[cells]).T.astype(np.uint16, order="C")
+        floor = floor_mask(terrain, None if walls is None else np.asarray(walls[cells]).T.copy())
+        source_mask = np.zeros(terrain.shape, dtype=bool)
+        for row, col in sources:
+            if row0 <= row < row1 and col0 <= col < col1:
+                source_mask[col - col0, row - row0] = True
+        source_mask &= floor
+        palette, offsets = self.palette(terrain_levels, water_levels)
+
+        tiles = [self.tiles[what] for what in ("ground", "water", "water_wave", "water_source")]
+        coverage = sum(tile.astype(int) << i for i, tile in enumerate(tiles))
+        signatures = {}
+        for signature in np.unique(coverage):
+            ground, water, wave, source = (bool(signature >> i & 1) for i in range(4))
+            static_index = np.zeros(terrain.shape, dtype=np.uint16)
+            if ground:
+                static_index[floor & ~source_mask] = terrain[floor & ~source_mask] + offsets["ground"]
+            if source:
+                static_index[source_mask] = offsets["water_source"]
+            wet_layer = "water_wave" if wave else "water" if water else None
+            signatures[signature] = (static_index, wet_layer, water and not source, np.nonzero(coverage == signature))
+        layout = {
+            "terrain": terrain,
+            "open": floor & ~source_mask,
+            "sources": source_mask,
+            "wave": terrain + np.uint16(offsets["water_wave"]),
+            "signatures": signatures,
+            # Colors as single 3-byte items, so that a lookup copies whole colors
+            "palette": palette.view("V3").reshape(-1),
+            "offsets": offsets,
+        }
+        self._layout = (key, terrain_grid, walls, layout)
+        return layout
+
+    def render(
+        self, terrain_grid, water_grid, sources, terrain_levels, water_levels,
+        walls=None, player=None, view=None, out=None
+    ):
+        """
+        :param terrain_grid: Integer terrain levels
+        :param water_grid: Integer water levels
+        :param sources: Iterable of source coordinates
+        :param walls: Boolean wall mask (default none)
+        :param player: Player coordinates, None to leave the player out
+        :param view: (first row, first column, stop row, stop column) of the cells to draw (default all)
+        :param out: uint8 array to draw into, of the shape of the image
+        :return: uint8 RGB image of shape (columns * scale, rows * scale, 3)
+        """
+        view = view if view is not None else (0, 0, *terrain_grid.shape)
+        layout = self.layout(terrain_grid, walls, sources, terrain_levels, water_levels, view)
+        row0, col0, row1, col1 = view
+        water = np.asarray(water_grid[row0:row1, col0:col1]).T.astype(np.uint16, order="C")
+        wet = layout["open"] & (water > 0)
+        offsets = layout["offsets"]
+
+        height, width = water.shape
+        s = self.scale
+        if out is None:
+            out = np.empty((height * s, width * s, 3), dtype=np.uint8)
+        image = out.reshape(height, s, width, s, 3)
+        colors = out.view("V3").reshape(height, width) if s == 1 else np.empty((height, width), dtype="V3")
+        for static_index, wet_layer, source_water, pixels in layout["signatures"].values():
+            index = static_index
+            if wet_layer == "water_wave":
+                index = np.where(wet, layout["wave"] + water, index)
+            elif wet_layer == "water":
+                index = np.where(wet, water + np.uint16(offsets["water"]), index)
+            if source_water:
+                index = np.where(layout["sources"], water + np.uint16(offsets["water"]), index)
+            np.take(layout["palette"], index, out=colors, mode="clip")
+            if s > 1:
+                for y, x in zip(*pixels):
+                    image[:, y, :, x] = colors.view(np.uint8).reshape(height, width, 3)
+        if player is not None and row0 <= player[0] < row1 and col0 <= player[1] < col1:
+            y, x = (player[1] - col0) * s, (player[0] - row0) * s
+            out[y:y + s, x:x + s][self.tiles["player"]] = _lut(Player.colors())
+        return out
+
+    def render_grid(self, grid, player=None, view=None, out=None):
+        """
+        Render a water grid, see `render`
+        """
+        return self.render(
+            grid.terrain_grid,
+            grid.water_grid,
+            grid._sources,
+            grid.terrain_levels,
+            grid.water_levels,
+            walls=grid.walls,
+            player=player,
+            view=view,
+            out=out
+        )
+
+
+def write_png(path, image, level=1):
+    """
+    Save an RGB image as PNG
+    :param image: uint8 array of shape (height, width, 3)
+    :param level: zlib compression level
+    """
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape[:2]
+    # every scanline starts with filter type 0
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(height, -1)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), level)))
+        f.write(chunk(b"IEND", b""))
@@ -1,3 +1,7 @@
+import shlex
+import time
+from collections import deque
+
 import ruamel.yaml
 import numpy as np
 import pygame as pg
@@ -6,25 +10,57 @@ from OpenGL.GL import *
 
 from . import maps, entities, controls
 from . import renderer
+from . import snapshot
+from .camera import Camera
+from .console import Console
 from .event import GameEvent
+from .framebuffer import FramebufferRenderer, write_png
+from .geometry import floor_mask
+from .metrics import Metrics
+from .worker import SimulationWorker
 
 
 class Game:
-    def __init__(self, config_file):
+    def __init__(self, config_file, controller=None, seed=None, headless=False):
+        """
+        :param config_file: Path to settings.yml
+        :param controller: ControllerABC (default keyboard)
+        :param seed: Map seed, overrides the config
+        :param headless: Run without a display
+        """
         self.Config = {}
         self.load_config(config_file)
         self.display_size = np.array((self.Config["display"]["width"], self.Config["display"]["height"]))
         self.view_size = np.array((self.Config["view"]["width"], self.Config["view"]["height"]))
         self.map_size = (self.Config["map"]["width"], self.Config["map"]["height"])
+        self.seed = seed if seed is not None else self.Config["map"].get("seed")
+        if self.seed is None:
+            self.seed = np.random.SeedSequence().entropy
         self.frame_rate = self.Config["frame rate"]
         self.display_compensation = (1, 1, 1)
         self.round = 0
         self.running = False
+        self.headless = headless
+
+        metrics = self.Config.get("metrics") or {}
+        self.metrics = Metrics(
+            window=metrics.get("window", 240),
+            enabled=metrics.get("enabled", False),
+            dump_path=metrics.get("dump path"),
+            dump_interval=metrics.get("dump interval", 5)
+        )
+        self._metrics_lines = []
+        self._last_report = 0
+        self.autoplay_interval = 0.1
+        # Rounds the worker may run ahead of the NPCs
+        self.npc_backlog = 64
 
         self.Clock = pg.time.Clock()
         self.all_sprites = pg.sprite.Group()
-        self.initialize_pygame()
-        self.initialize_objects()
+        if not self.headless:
+            self.initialize_pygame()
+        self.initialize_objects(controller)
+        self.start_console()
 
 
     def load_config(self, config_file):
@@ -39,62 +75,231 @@ class Game:
         elif self.display_size[1] < self.display_size[0]:
             self.display_compensation = (1, self.display_size[0]/self.display_size[1], 1)
 
-    def initialize_objects(self):
-        self.controller = controls.PyGameKeyboard()
+    def initialize_objects(self, controller=None):
+        self.controller = controller if controller is not None else controls.PyGameKeyboard()
         self.renderer = renderer.Renderer()
         self.grid = maps.FrExWaterGrid(
             shape=self.map_size,
-            depth_first_factor=5
+            depth_first_factor=5,
+            chunk_size=self.Config["map"].get("chunk size", 32),
+            overview_block=(self.Config.get("minimap") or {}).get("block", 8),
+            # a stream independent of the terrain generated from the same seed
+            seed=[self.seed, 1]
         )
-        terrain = maps.generate_terrain(
+        self.terrain_cache = maps.TerrainCache(
+            self.Config["terrain cache"]["directory"],
+            max_size=self.Config["terrain cache"]["max size"] * 2**20
+        )
+        terrain, walls = self.terrain_cache.generate_terrain(
             shape=self.map_size,
             levels=8,
             preset="perlin",
             cave=0.4,
-            extra_cave=0.3
+            extra_cave=0.3,
+            seed=self.seed,
+            compact=True
         )
-        self.grid.set_terrain(terrain)
+        self.grid.set_terrain(terrain, walls)
         self.grid.add_source((10, 20))
         self.grid.add_source((30, 30))
         self.player = entities.Player()
         self.player.set_coords((5, 5))
+        self.spawn_npcs()
+        camera = self.Config.get("camera") or {}
+        self.camera = Camera(
+            # The view spans 2 * view_size display units, stretched by the display compensation
+            2 * self.view_size / self.display_compensation[:2] / self.renderer.scale,
+            self.map_size,
+            dead_zone=camera.get("dead zone", 0.5),
+            zoom=camera.get("zoom", 1),
+            margin=camera.get("margin", 2)
+        )
+        self.camera.look_at((self.player.x, self.player.y))
+        self.start_worker()
+
+    def spawn_npcs(self):
+        """
+        Place `npcs: count` NPCs on random floor cells
+        """
+        npcs = entities.EntityStore(self.map_size)
+        count = (self.Config.get("npcs") or {}).get("count", 0)
+        floor = np.argwhere(floor_mask(self.grid.terrain_grid, self.grid.walls))
+        rng = np.random.default_rng([self.seed, 2])
+        npcs.add(floor[rng.choice(len(floor), size=min(count, len(floor)), replace=False)])
+        self.start_npcs(npcs)
+
+    def start_npcs(self, npcs):
+        """
+        Let an EntityStore of NPCs play on the grid, fleeing the water.
+        NPCs play every round on the water committed in that round, the same with a worker,
+        a frame budget or neither, so that replays reproduce them.
+        """
+        self.npcs = npcs
+        self.npc_field = maps.DistanceField(
+            self.grid.terrain_grid,
+            self.grid.walls,
+            from_water=True,
+            flee=(self.Config.get("npcs") or {}).get("flee", 1.2)
+        )
+        # The water as of the last round the NPCs played, and (round, changed cells, their levels)
+        # of the committed rounds they have not played yet
+        self._npc_water = self.grid.water_grid.copy()
+        self._npc_round = self.round
+        self._npc_rounds = deque()
+        self.grid.round_listeners.append(self.npc_round_committed)
+
+    def npc_round_committed(self, r, cells):
+        """
+        Keep the changes of a committed round for the NPCs, runs on the worker thread with a worker
+        """
+        self._npc_rounds.append((r, cells, self.grid.water_grid.flat[cells]))
+
+    def update_npcs(self):
+        """
+        Play the NPCs in the rounds committed since the last call
+        """
+        while self._npc_rounds:
+            r, cells, levels = self._npc_rounds.popleft()
+            self._npc_water.flat[cells] = levels
+            self.npc_field.refresh(self._npc_water, cells)
+            self.npcs.step_update(r, None, water_grid=self._npc_water, field=self.npc_field)
+            self._npc_round = r
+
+    def start_console(self):
+        """
+        Accept console commands in interactive sessions only, replays and benchmarks
+        neither read stdin nor bind the socket
+        """
+        self.console = None
+        if not self.controller.realtime or self.headless:
+            return
+        console = self.Config.get("console") or {}
+        self.console = Console(stdin=console.get("stdin", True), socket_path=console.get("socket"))
+
+    def start_worker(self):
+        """
+        Move the grid onto a background thread, see `flood.worker`, or else spread its rounds
+        over frames within the frame budget.
+        Only real-time play on a display benefits, other runs play whole rounds on the main thread.
+        """
+        self.worker = None
+        self.grid.frame_budget = None
+        if not self.controller.realtime or self.headless:
+            return
+        if self.Config.get("background simulation", False):
+            self.worker = SimulationWorker(self.grid)
+        elif self.Config.get("frame budget") is not None:
+            self.grid.frame_budget = self.Config["frame budget"] / 1000
 
     def run(self):
         """
-        Execute the game loop
+        Execute the game loop.
+        Controllers that are not real-time play a round every iteration, without waiting for the clock.
+        Autoplay submits the next round once the previous one is done,
+        immediately with a background worker and at most every `autoplay_interval` seconds otherwise.
+        Console commands run between input and the round.
         """
         last_update = 0
         self.running = True
         self.waiting_for_player_input = True
         self.autoplay = False
+        realtime = self.controller.realtime
         while self.running:
-            t = pg.time.get_ticks() / 1000
+            t = pg.time.get_ticks() / 1000 if realtime else float(self.round)
+            self.metrics.start()
 
             events = self.controller.get_events()
+            self.metrics.lap("input")
             self.process_events(events)
+            self.run_commands(t)
+            self.metrics.lap("process_events")
 
-            if len(events) > 0:
+            if not realtime:
+                if self.running:
+                    self.step_update(t, events)
+            elif len(events) > 0:
                 last_update = t
                 self.step_update(t, events)
-            elif self.autoplay and t - last_update > 0.1:
+            elif (
+                self.autoplay and not self.simulation_busy()
+                and (self.worker or t - last_update > self.autoplay_interval)
+            ):
                 last_update = t
                 self.step_update(t, events)
+            self.metrics.lap("step_update")
 
             self.continuous_update(t)
+            self.metrics.lap("continuous_update")
+
+            if not self.headless:
+                self.draw(t)
+            self.metrics.lap("draw")
+
+            if realtime:
+                self.Clock.tick(self.frame_rate)
+            self.metrics.lap("tick")
+            self.update_metrics()
 
-            self.draw(t)
+        if self.worker:
+            self.worker.stop()
+        if self.console:
+            self.console.close()
 
-            self.Clock.tick(self.frame_rate)
+    def update_metrics(self):
+        """
+        Refresh the overlay text four times a second while it is shown, and dump reports when due
+        """
+        if not self.metrics.enabled:
+            return
+        dump = self.metrics.dump_due()
+        if not dump and not (self.metrics.overlay and time.monotonic() - self._last_report >= 0.25):
+            return
+        self._last_report = time.monotonic()
+        report = self.metrics.report(self.metrics_counters())
+        self._metrics_lines = self.metrics.format(report)
+        if dump:
+            self.metrics.dump(report)
+
+    def metrics_counters(self):
+        return {
+            "round": self.round,
+            "expansions/s": self.metrics.rate("expansions", self.grid.total_steps),
+            "frontier length": self.grid.frontier_size,
+            "explored": self.grid.explored_size,
+            "skipped pops": self.grid.skipped_pops,
+            "npcs": len(self.npcs),
+            "draw calls": self.renderer.draw_calls,
+        }
+
+    def simulation_busy(self):
+        """
+        True while submitted rounds are not done
+        """
+        if self.worker:
+            return self.worker.busy
+        return self.grid.scheduled_rounds > 0
 
     def continuous_update(self, t):
-        self.grid.continuous_update(t, None)
+        self.camera.follow((self.player.x, self.player.y))
+        if not self.worker:
+            self.grid.continuous_update(t, None)
+        self.update_npcs()
 
     def step_update(self, t, events):
         self.round += 1
         self.player.step_update(self.round, events)
-        self.grid.step_update(self.round, None)
+        if self.worker:
+            if self.round - self._npc_round > self.npc_backlog:
+                self.worker.wait()
+                self.update_npcs()
+            self.worker.submit(self.round)
+        else:
+            self.grid.step_update(self.round, None)
+        self.update_npcs()
+        self.controller.round_played(self.round, events)
 
     def draw(self, t):
+        self.renderer.draw_calls = 0
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         glPushMatrix()
 
@@ -105,23 +310,207 @@ class Game:
         glTranslate(*(-self.view_size), 0)
         # Compensate display ratio distortion
         glScale(*self.display_compensation)
+        # Zoom and scroll to the camera
+        glScale(self.camera.zoom, self.camera.zoom, 1)
+        glTranslate(*(-self.camera.origin * self.renderer.scale), 0)
 
-        self.grid.draw(t, self.renderer)
+        (self.worker or self.grid).draw(t, self.renderer, view=self.visible_cells())
+        self.npcs.draw(t, self.renderer, view=self.visible_cells())
         self.player.draw(t, self.renderer)
 
         glPopMatrix()
+        self.draw_minimap()
+        if self.metrics.overlay:
+            self.renderer.draw_text(self._metrics_lines)
         pg.display.flip()
 
+    def draw_minimap(self):
+        """
+        Block overview of the map in the top right corner, with the player as a white pixel
+        """
+        minimap = self.Config.get("minimap") or {}
+        if not minimap.get("enabled", False):
+            return
+        overview = (self.worker or self.grid).overview
+        image = overview.image.copy()
+        block = (self.player.x // overview.block, self.player.y // overview.block)
+        if 0 <= block[0] < image.shape[1] and 0 <= block[1] < image.shape[0]:
+            image[block[1], block[0]] = 255
+        zoom = minimap.get("size", 200) / max(image.shape[:2])
+        self.renderer.draw_image(image, (self.display_size[0] - image.shape[1] * zoom - 8, 8), zoom)
+
+    def visible_cells(self):
+        """
+        Cells inside the camera view and its margin, (first row, first column, stop row, stop column)
+        """
+        return self.camera.visible()
+
+    def save(self, path):
+        """
+        Write the game state into a snapshot file, see `flood.snapshot`
+        """
+        if self.worker:
+            self.worker.wait()
+        meta, arrays = self.grid.get_state()
+        self.update_npcs()
+        npc_meta, npc_arrays = self.npcs.get_state()
+        arrays.update({"npc_" + name: array for name, array in npc_arrays.items()})
+        meta = {
+            "game": {
+                "round": self.round,
+                "seed": self.seed,
+                "player": [int(self.player.x), int(self.player.y)],
+            },
+            "grid": meta,
+            "npcs": npc_meta,
+        }
+        snapshot.write_snapshot(path, meta, arrays)
+
+    def load(self, path):
+        """
+        Restore the game state from a snapshot file, the grid arrays are memory-mapped
+        """
+        meta, arrays = snapshot.read_snapshot(path)
+        if self.worker:
+            self.worker.stop()
+        self.map_size = tuple(meta["grid"]["shape"])
+        self.grid = maps.FrExWaterGrid(
+            shape=self.map_size,
+            overview_block=(self.Config.get("minimap") or {}).get("block", 8)
+        )
+        self.grid.set_state(meta["grid"], arrays)
+        self.round = meta["game"]["round"]
+        self.seed = meta["game"]["seed"]
+        self.player.set_coords(tuple(meta["game"]["player"]))
+        npcs = entities.EntityStore(self.map_size)
+        if "npcs" in meta:
+            npcs.set_state(meta["npcs"], {
+                name[len("npc_"):]: array for name, array in arrays.items() if name.startswith("npc_")
+            })
+        self.start_npcs(npcs)
+        self.camera.map_size = np.asarray(self.map_size, dtype=float)
+        self.camera.look_at((self.player.x, self.player.y))
+        self.start_worker()
+
     def process_events(self, events):
         if GameEvent["game.quit"] in events:
             events.remove(GameEvent["game.quit"])
             self.running = False
         if GameEvent["game.autoplay"] in events:
             events.remove(GameEvent["game.autoplay"])
-            self.autoplay = ~self.autoplay
+            self.autoplay = not self.autoplay
+        if GameEvent["game.metrics"] in events:
+            events.remove(GameEvent["game.metrics"])
+            self.metrics.toggle_overlay()
+        if GameEvent["game.zoom_in"] in events:
+            events.remove(GameEvent["game.zoom_in"])
+            self.camera.set_zoom(self.camera.zoom * 1.25)
+        if GameEvent["game.zoom_out"] in events:
+            events.remove(GameEvent["game.zoom_out"])
+            self.camera.set_zoom(self.camera.zoom / 1.25)
         if GameEvent["game.command"] in events:
             events.remove(GameEvent["game.command"])
-            self.get_command_input()
+            print(";;; commands:", ", ".join(sorted(self.commands)), flush=True)
+
+    @property
+    def commands(self):
+        """
+        Console commands by name, see `flood.console`
+        """
+        return {
+            "rounds": self.command_rounds,
+            "stats": self.command_stats,
+            "source": self.command_source,
+            "autoplay": self.command_autoplay,
+            "save": self.command_save,
+            "screenshot": self.command_screenshot,
+            "quit": self.command_quit,
+        }
 
-    def get_command_input(self):
-        command = input(";;; ")
+    def run_commands(self, t):
+        """
+        Execute the queued console commands, each gets a text reply, errors included
+        """
+        if self.console is None:
+            return
+        for command in self.console.pending():
+            try:
+                name, *args = shlex.split(command.line)
+                if name not in self.commands:
+                    raise ValueError(f"unknown command, try: {', '.join(sorted(self.commands))}")
+                command.reply(self.commands[name](t, *args))
+            except Exception as e:
+                command.reply(f"{command.line}: {type(e).__name__}: {e}")
+
+    def command_rounds(self, t, n):
+        """
+        rounds N: play N rounds without input or drawing
+        """
+        start = time.perf_counter()
+        for _ in range(int(n)):
+            self.step_update(t, set())
+        if self.worker:
+            return f"{n} rounds submitted, up to round {self.round}"
+        self.grid.flush()
+        return f"{n} rounds in {time.perf_counter() - start:.3f} s, round {self.round}"
+
+    def command_stats(self, t):
+        """
+        stats: report the metrics, and dump them if a dump path is set
+        """
+        report = self.metrics.report(self.metrics_counters())
+        if self.metrics.dump_path is not None:
+            self.metrics.dump(report)
+        return "\n".join(self.metrics.format(report))
+
+    def command_source(self, t, action, row, col):
+        """
+        source add|remove ROW COL, refused while recording, recordings only hold the in-game events
+        """
+        if isinstance(self.controller, controls.RecordingController):
+            raise RuntimeError("sources cannot change while recording, the replay would differ")
+        coords = (int(row), int(col))
+        if not (0 <= coords[0] < self.map_size[0] and 0 <= coords[1] < self.map_size[1]):
+            raise ValueError(f"{coords} is outside the map")
+        func = {"add": self.grid.add_source, "remove": self.grid.remove_source}.get(action)
+        if func is None:
+            raise ValueError(f"unknown action {action}, use add or remove")
+        if self.worker:
+            self.worker.call(func, coords)
+        else:
+            func(coords)
+        return f"source {action} {coords}"
+
+    def command_autoplay(self, t, setting=None):
+        """
+        autoplay [on|off|SECONDS]: toggle autoplay, or set the seconds between autoplayed rounds
+        """
+        if setting is None:
+            self.autoplay = not self.autoplay
+        elif setting in ("on", "off"):
+            self.autoplay = setting == "on"
+        else:
+            self.autoplay_interval = float(setting)
+            self.autoplay = True
+        return f"autoplay {'on' if self.autoplay else 'off'}, every {self.autoplay_interval} s"
+
+    def command_save(self, t, path):
+        """
+        save PATH: write a snapshot, see `save`
+        """
+        self.save(path)
+        return f"saved round {self.round} to {path}"
+
+    def command_screenshot(self, t, path, scale=1):
+        """
+        screenshot PATH [SCALE]: save the whole map as PNG, SCALE pixels per cell, see `flood.framebuffer`
+        """
+        if self.worker:
+            self.worker.wait()
+        image = FramebufferRenderer(int(scale)).render_grid(self.grid, player=(self.player.x, self.player.y))
+        write_png(path, image)
+        return f"saved {image.shape[1]}x{image.shape[0]} screenshot of round {self.round} to {path}"
+
+    def command_quit(self, t):
+        self.running = False
+        return "bye"
@@ -0,0 +1,407 @@
+import abc
+
+import numpy as np
+
+
+class SpriteABC(abc.ABC):
+    terrain_range = None
+    water_range = None
+
+    @classmethod
+    def configure(cls, terrain_range=None):
+        if terrain_range is not None:
+            cls.terrain_range = terrain_range
+            cls.water_range = terrain_range + 2
+
+    @classmethod
+    def colors(cls, **kwargs):
+        """
+        Vectorized sprite color
+        :return: RGB array of shape (..., 3)
+        """
+        raise NotImplementedError()
+
+
+class Ground(SpriteABC):
+    color = np.array((0.5, 0.45, 0.45))
+    primitive = "quads"
+    padding = 0.1
+    vertices = [
+        (padding, padding),
+        (1 - padding, padding),
+        (1 - padding, 1 - padding),
+        (padding, 1 - padding)
+    ]
+
+    @classmethod
+    def configure(cls, padding=None):
+        if padding is not None:
+            cls.padding = padding
+
+    @classmethod
+    def colors(cls, *, terrain_level):
+        return cls.color * np.asarray(terrain_level)[..., None]
+
+
+class Player(SpriteABC):
+    color = np.array((1, 1, 1))
+    primitive = "quads"
+    vertices = [
+        (0.5, 0),
+        (1, 0.5),
+        (0.5, 1),
+        (0, 0.5)
+    ]
+
+    @classmethod
+    def colors(cls):
+        return cls.color
+
+
+class Npc(SpriteABC):
+    color = np.array((0.9, 0.6, 0.2))
+    color_cold = np.array((0.6, 0.8, 1))
+    primitive = "quads"
+    vertices = [
+        (0.5, 0.2),
+        (0.8, 0.5),
+        (0.5, 0.8),
+        (0.2, 0.5)
+    ]
+
+    @classmethod
+    def colors(cls, *, health, cold=False):
+        color = np.where(np.asarray(cold)[..., None], cls.color_cold, cls.color)
+        return color * (0.4 + 0.6 * np.asarray(health)[..., None])
+
+
+class Water(SpriteABC):
+    color = np.array((0.3, 0.4, 1))
+    primitive = "quads"
+    vertices = [
+        (0, 0),
+        (1, 0),
+        (1, 1),
+        (0, 1)
+    ]
+
+    @classmethod
+    def colors(cls, *, water_level):
+        water_level = np.asarray(water_level)[..., None]
+        # return cls.color_water * water_level / cls.terrain_range
+        return np.concatenate((
+            cls.color[:2] * (1 - water_level),
+            np.cos(water_level * np.pi / 2)
+        ), axis=-1)
+
+
+class Wave(SpriteABC):
+    color = np.array((0.7, 0.7, 1))
+    primitive = "lines"
+    vertices = [
+        (0, 0.35),
+        (0.7, 0.15),
+        (0.3, 0.85),
+        (1, 0.65)
+    ]
+
+    @classmethod
+    def colors(cls, *, total_level):
+        return cls.color * np.asarray(total_level)[..., None]
+
+
+class WaterSource(SpriteABC):
+    color = np.array((.6, .6, 1.))
+    primitive = "quads"
+    vertices = [
+        (0., 0.),
+        (0.5, 0.3),
+        (1.0, 0.),
+        (0.5, 1.0),
+    ]
+
+    @classmethod
+    def colors(cls):
+        return cls.color
+
+
+def cell_geometry(sprite, rows, cols, visible=None, **levels):
+    """
+    Vertex and color arrays for drawing `sprite` on the given cells at once, in the given order.
+    Hidden cells are collapsed into a single point so that they keep their place in the arrays.
+    :param sprite: Sprite class
+    :param rows: Row coordinates of the cells
+    :param cols: Column coordinates of the cells
+    :param visible: Boolean array, which of the cells are drawn (default all)
+    :param levels: Per-cell level arrays passed to `sprite.colors`
+    :return: (vertices, colors) float32 arrays of shape (n_cells * n_vertices, 2) and (n_cells * n_vertices, 3)
+    """
+    shape_vertices = np.asarray(sprite.vertices, dtype=np.float32)
+    n_vertices = len(shape_vertices)
+    cells = np.stack((rows, cols), axis=-1).astype(np.float32)
+    if visible is None:
+        offsets = shape_vertices[None, :, :]
+    else:
+        offsets = np.where(np.asarray(visible)[:, None, None], shape_vertices[None, :, :], 0)
+    vertices = (cells[:, None, :] + offsets).reshape(-1, 2)
+    colors = np.broadcast_to(sprite.colors(**levels), (len(cells), 3))
+    colors = np.repeat(colors, n_vertices, axis=0).astype(np.float32)
+    return vertices, colors
+
+
+def sprite_geometry(sprite, mask, **levels):
+    """
+    Vertex and color arrays for drawing `sprite` on every cell of `mask` at once
+    :param sprite: Sprite class
+    :param mask: Boolean array, cells to draw
+    :param levels: Per-cell level arrays passed to `sprite.colors`, indexed by `mask`
+    :return: (vertices, colors) float32 arrays of shape (n_cells * n_vertices, 2) and (n_cells * n_vertices, 3)
+    """
+    rows, cols = np.nonzero(mask)
+    return cell_geometry(sprite, rows, cols, **{key: level[mask] for key, level in levels.items()})
+
+
+def floor_mask(terrain_grid, walls=None):
+    """
+    Boolean mask of the cells that are not walls
+    :param terrain_grid: Terrain levels, float with NaN walls if `walls` is not given
+    :param walls: Boolean wall mask
+    """
+    if walls is not None:
+        return ~np.asarray(walls, dtype=bool)
+    if np.issubdtype(terrain_grid.dtype, np.floating):
+        return ~np.isnan(terrain_grid)
+    return np.ones(terrain_grid.shape, dtype=bool)
+
+
+class GridLayers:
+    """
+    Persistent layer buffers of a water grid
+    =========================================
+
+    The ground layer is built once, water and wave layers hold one slot per cell
+    and only the slots of changed cells are rebuilt. Changed vertex ranges are remembered
+    until the renderer takes them for upload.
+    Vertices are placed at `origin` + cell coordinates, so that a part of a larger grid can have its own layers.
+    """
+    names = ("ground", "water", "water_wave", "water_source")
+
+    def __init__(self, terrain_grid, water_grid, sources, terrain_levels, water_levels, origin=(0, 0), walls=None):
+        self.shape = terrain_grid.shape
+        self.origin = origin
+        self.terrain_grid = terrain_grid
+        self.terrain_levels = terrain_levels
+        self.water_levels = water_levels
+        self.floor = floor_mask(terrain_grid, walls)
+        self.source_mask = np.zeros(self.shape, dtype=bool)
+        self.layers = {}
+        self._modified = {}
+
+        # Water covers the ground, so the ground can be drawn everywhere and never changes
+        terrain_level = (np.asarray(terrain_grid, dtype=np.float32) - 1) / terrain_levels
+        self.layers["ground"] = self._shift(sprite_geometry(Ground, self.floor, terrain_level=terrain_level))
+        self._modified["ground"] = None
+
+        n_cells = self.floor.size
+        self.layers["water"] = (
+            np.zeros((n_cells * len(Water.vertices), 2), dtype=np.float32),
+            np.zeros((n_cells * len(Water.vertices), 3), dtype=np.float32)
+        )
+        self.layers["water_wave"] = (
+            np.zeros((n_cells * len(Wave.vertices), 2), dtype=np.float32),
+            np.zeros((n_cells * len(Wave.vertices), 3), dtype=np.float32)
+        )
+        self._modified["water"] = None
+        self._modified["water_wave"] = None
+        self.set_sources(sources, water_grid)
+        self.update(water_grid, np.arange(n_cells))
+
+    def __getitem__(self, what):
+        return self.layers[what]
+
+    def items(self):
+        return self.layers.items()
+
+    def set_sources(self, sources, water_grid):
+        """
+        Rebuild the source layer and the water slots of source cells
+        """
+        old_sources = np.flatnonzero(self.source_mask)
+        self.source_mask[:] = False
+        if sources:
+            self.source_mask[tuple(np.array(list(sources)).T)] = True
+        self.source_mask &= self.floor
+        self.layers["water_source"] = self._shift(sprite_geometry(WaterSource, self.source_mask))
+        self._modified["water_source"] = None
+        self.update(water_grid, np.union1d(old_sources, np.flatnonzero(self.source_mask)))
+
+    def update(self, water_grid, cells):
+        """
+        Rebuild the water and wave slots of the given cells
+        :param water_grid: Current water levels
+        :param cells: Flat indices of changed cells
+        """
+        cells = np.asarray(cells, dtype=np.intp)
+        if len(cells) == 0:
+            return
+        rows, cols = np.unravel_index(cells, self.shape)
+        floor = self.floor[rows, cols]
+        source = self.source_mask[rows, cols]
+        water = water_grid[rows, cols].astype(np.float32)
+        terrain = self.terrain_grid[rows, cols].astype(np.float32)
+        wet = floor & (water > 0)
+        x, y = rows + self.origin[0], cols + self.origin[1]
+
+        self._patch("water", cells, cell_geometry(
+            Water, x, y, source | wet,
+            water_level=(water - 1) / self.water_levels
+        ))
+        self._patch("water_wave", cells, cell_geometry(
+            Wave, x, y, wet & ~source,
+            # water shouldn't rise above max_terrain+2
+            total_level=(terrain + water - 1) / (self.terrain_levels + 2)
+        ))
+
+    def _shift(self, geometry):
+        vertices, colors = geometry
+        vertices += np.asarray(self.origin, dtype=np.float32)
+        return vertices, colors
+
+    def _patch(self, what, cells, geometry):
+        vertices, colors = self.layers[what]
+        n_vertices = len(vertices) // self.floor.size
+        slots = (cells[:, None] * n_vertices + np.arange(n_vertices)).ravel()
+        vertices[slots], colors[slots] = geometry
+        if self._modified.get(what, ()) is not None:
+            self._modified[what] = np.union1d(self._modified.get(what, ()), cells).astype(np.intp)
+
+    def take_modified(self, what):
+        """
+        Vertex ranges changed since the last call
+        :return: None if the whole layer changed, otherwise a list of (start, stop) vertex ranges
+        """
+        cells = self._modified.get(what, ())
+        self._modified[what] = ()
+        if cells is None:
+            return None
+        if len(cells) == 0:
+            return []
+        n_vertices = len(self.layers[what][0]) // self.floor.size
+        breaks = np.flatnonzero(np.diff(cells) > 1) + 1
+        return [
+            (int(run[0]) * n_vertices, (int(run[-1]) + 1) * n_vertices)
+            for run in np.split(cells, breaks)
+        ]
+
+
+class ChunkedLayers:
+    """
+    Grid layers split into chunks
+    ==============================
+
+    Every `chunk_size` x `chunk_size` chunk of the grid has its own GridLayers, built the first time
+    the chunk is visible. Changed cells are queued per chunk and applied when the chunk is drawn.
+    Chunks without changes sleep: they keep their buffers and cost nothing until water reaches them.
+    """
+    def __init__(self, terrain_grid, water_grid, sources, terrain_levels, water_levels, chunk_size=32, walls=None):
+        self.shape = terrain_grid.shape
+        self.chunk_size = chunk_size
+        self.chunk_shape = tuple(-(-size // chunk_size) for size in self.shape)
+        self.terrain_grid = terrain_grid
+        self.walls = ~floor_mask(terrain_grid, walls)
+        self.water_grid = water_grid
+        self.terrain_levels = terrain_levels
+        self.water_levels = water_levels
+        self.sources = set(sources)
+        self.chunks = {}
+        # Local flat indices of changed cells by chunk
+        self._pending = {}
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _slices(self, chunk):
+        return tuple(
+            slice(i * self.chunk_size, min((i + 1) * self.chunk_size, size))
+            for i, size in zip(chunk, self.shape)
+        )
+
+    def _local_sources(self, chunk):
+        origin = (chunk[0] * self.chunk_size, chunk[1] * self.chunk_size)
+        return {
+            (row - origin[0], col - origin[1])
+            for row, col in self.sources
+            if row // self.chunk_size == chunk[0] and col // self.chunk_size == chunk[1]
+        }
+
+    def get(self, chunk):
+        """
+        Layers of a chunk, built on first use and brought up to date
+        :param chunk: (chunk row, chunk column)
+        :return: GridLayers
+        """
+        layers = self.chunks.get(chunk)
+        if layers is None:
+            self._pending.pop(chunk, None)
+            rows, cols = self._slices(chunk)
+            layers = self.chunks[chunk] = GridLayers(
+                self.terrain_grid[rows, cols],
+                self.water_grid[rows, cols],
+                self._local_sources(chunk),
+                self.terrain_levels,
+                self.water_levels,
+                origin=(rows.start, cols.start),
+                walls=self.walls[rows, cols]
+            )
+        elif chunk in self._pending:
+            rows, cols = self._slices(chunk)
+            cells = np.unique(np.concatenate(self._pending.pop(chunk)))
+            layers.update(self.water_grid[rows, cols], cells)
+        return layers
+
+    def visible(self, view=None):
+        """
+        Chunks that overlap a view
+        :param view: (first row, first column, stop row, stop column) in cells (default the whole grid)
+        :return: List of (chunk row, chunk column)
+        """
+        if view is None:
+            view = (0, 0, *self.shape)
+        start = [max(0, int(v) // self.chunk_size) for v in view[:2]]
+        stop = [
+            min(n, -(-int(v) // self.chunk_size))
+            for v, n in zip(view[2:], self.chunk_shape)
+        ]
+        return [(i, j) for i in range(start[0], stop[0]) for j in range(start[1], stop[1])]
+
+    def set_sources(self, sources, water_grid):
+        self.sources = set(sources)
+        self.water_grid = water_grid
+        for chunk, layers in self.chunks.items():
+            rows, cols = self._slices(chunk)
+            layers.set_sources(self._local_sources(chunk), water_grid[rows, cols])
+
+    def update(self, water_grid, cells):
+        """
+        Queue changed cells for the chunks that are built, unbuilt chunks read the grid when they are built
+        :param water_grid: Current water levels
+        :param cells: Flat indices of changed cells
+        """
+        self.water_grid = water_grid
+        cells = np.asarray(cells, dtype=np.intp)
+        if len(cells) == 0 or not self.chunks:
+            return
+        rows, cols = np.unravel_index(cells, self.shape)
+        chunk_rows, local_rows = np.divmod(rows, self.chunk_size)
+        chunk_cols, local_cols = np.divmod(cols, self.chunk_size)
+        chunk_ids = chunk_rows * self.chunk_shape[1] + chunk_cols
+        order = np.argsort(chunk_ids, kind="stable")
+        chunk_ids = chunk_ids[order]
+        breaks = np.flatnonzero(np.diff(chunk_ids)) + 1
+        for run in np.split(np.arange(len(order)), breaks):
+            chunk = divmod(int(chunk_ids[run[0]]), self.chunk_shape[1])
+            if chunk not in self.chunks:
+                continue
+            width = self._slices(chunk)[1].stop - chunk[1] * self.chunk_size
+            local = local_rows[order[run]] * width + local_cols[order[run]]
+            self._pending.setdefault(chunk, []).append(local)
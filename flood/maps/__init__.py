@@ -1,11 +1,21 @@
 from .simplewatergrid import SimpleWaterGrid
 from .cellularwatergrid import CellularWaterGrid
 from .frexwatergrid import FrExWaterGrid
-from .utils import generate_terrain
+from .flowfield import FlowField
+from .overview import Overview
+from .distancefield import DistanceField
+from .utils import generate_terrain, compact_terrain, expand_terrain
+from .terraincache import TerrainCache
 
 __all__ = [
     "SimpleWaterGrid",
     "CellularWaterGrid",
     "FrExWaterGrid",
-    "generate_terrain"
+    "FlowField",
+    "Overview",
+    "DistanceField",
+    "generate_terrain",
+    "compact_terrain",
+    "expand_terrain",
+    "TerrainCache"
 ]
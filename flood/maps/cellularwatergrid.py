@@ -1,223 +1,219 @@
-from typing import Dict
 import numpy as np
-from OpenGL.GL import *
 
 from flood.abc.drawable import DrawableABC
-from .utils import generate_terrain
+from .utils import generate_terrain, compact_terrain
 from ..entities.abc import EntityABC
+from ..geometry import ChunkedLayers
+
+# Neighbor directions, the order of the first axis of per-direction arrays
+RIGHT, UP, LEFT, DOWN = range(4)
+OPPOSITE = (LEFT, DOWN, RIGHT, UP)
+
+
+def shift(grid, direction, fill):
+    """
+    Values of the neighbors in a direction, for all cells at once
+    :param grid: Array, the last two axes are the grid
+    :param direction: RIGHT, UP, LEFT or DOWN
+    :param fill: Value for neighbors outside the grid
+    :return: Array of the same shape as `grid`
+    """
+    shifted = np.full_like(grid, fill)
+    if direction == RIGHT:
+        shifted[..., :, :-1] = grid[..., :, 1:]
+    elif direction == UP:
+        shifted[..., 1:, :] = grid[..., :-1, :]
+    elif direction == LEFT:
+        shifted[..., :, 1:] = grid[..., :, :-1]
+    else:
+        shifted[..., :-1, :] = grid[..., 1:, :]
+    return shifted
+
+
+def bounding_box(mask):
+    """
+    :return: (first row, first column, stop row, stop column) of the True cells, None if there are none
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return rows[0], cols[0], rows[-1] + 1, cols[-1] + 1
+
+
+class CellularWaterGrid(EntityABC, DrawableABC):
+    """
+    Cellular Water Grid
+    ====================
+
+    Flow-based cellular automaton. Water, flow and slant are whole-grid arrays
+    (flow and slant with one plane per direction) and every step works on all cells at once
+    with shifted arrays.
+
+    Each round, cells with more than 2 water levels pass water along the average flow
+    of their neighborhood, then every wet cell splits its surplus with its lowest neighbor
+    (ties are broken at random). A cell keeps at least one level of what it has
+    and receives at most `capacity` levels per round.
+    The flow of a cell is the net water it received per direction.
+    Water spreads at most one cell per round, so a step only works on the bounding box
+    of the cells with water, flow or a source, grown by one cell.
+    """
+    capacity = 10
 
-
-class Cell(EntityABC, DrawableABC):
-    neighbor_vectors = np.array((
-        (0, 1),   # RIGHT
-        (-1, 0),  # UP
-        (0, -1),  # LEFT
-        (1, 0)    # DOWN
-    ))
-
-    def __init__(self, grid, coords, terrain_level, water_level):
-        raise NotImplementedError("Deprecated.")
-        self.grid = grid
-        self.coords = coords
-        self.terrain_level = terrain_level
-        self.water_level = water_level
-        self.neighbors: Dict[int, Cell] = {}
-        self.received_water = [0, 0, 0, 0]
-        self.given_water = 0
-
-        # Initiate flow with a tiny number in random direction
-        # self.flow = (np.random.random(2) - 0.5)/10
-        self.flow = np.zeros(4)
-        self.slant = np.zeros(4)
-        self.new_flow = np.zeros(4)
-        self.flow_vectors = self.neighbor_vectors.copy()
-
-    def initialize(self):
-        self.neighbors = self.grid.get_neighbors(self.coords)
-
-        for i, n in self.neighbors.items():
-            slant = self.terrain_level - n.terrain_level
-            if slant != 0:
-                self.slant[i] = slant
-
-    def absolute_level(self):
-        return self.water_level + self.terrain_level
-
-    def can_receive(self):
-        return 10 - sum(self.received_water)
-
-    def calculate_step_update(self, r):
-        if self.water_level <= 0:
-            return
-
-        # 1) Distribute water down the slope
-
-        # for i, slant in enumerate(self.slant):
-        #     if self.water_level <= self.given_water:
-        #         return
-        #     if slant > 0 and i in self.neighbors:
-        #         amount = min(
-        #             np.ceil(self.water_level * 0.1 * slant),
-        #             self.water_level,
-        #             self.neighbors[i].can_receive()
-        #         )
-        #         self.neighbors[i].received_water[i] += amount
-        #         self.given_water += amount
-
-        # 2) Flow
-
-        if self.water_level > 2:
-            average_flow = (
-                np.sum([cell.flow for cell in self.neighbors.values()], axis=0) + 0.1*self.flow
-            ) / (len(self.neighbors) + 0.1)
-            # average_flow += 3*self.slant
-
-            for i, flow in enumerate(average_flow):
-                if self.water_level <= self.given_water:
-                    return
-                if flow > 0 and i in self.neighbors and self.slant[i] + 0.1*self.water_level >= 0:
-                    amount = min(
-                        np.ceil(self.water_level * 0.1) * flow + self.slant[i],
-                        self.water_level - 1,
-                        self.neighbors[i].can_receive()
-                    )
-                    # amount = (flow + 1) // 2
-                    self.neighbors[i].received_water[i] += amount
-                    self.given_water += amount
-
-        # 3) Split the surplus with the lowest neighbor
-
-        neighbor_levels = np.array((
-            self.neighbors[0].absolute_level() if 0 in self.neighbors else np.nan,
-            self.neighbors[1].absolute_level() if 1 in self.neighbors else np.nan,
-            self.neighbors[2].absolute_level() if 2 in self.neighbors else np.nan,
-            self.neighbors[3].absolute_level() if 3 in self.neighbors else np.nan,
-        ))
-        neighbor_difference = self.absolute_level() - neighbor_levels - self.given_water
-        direction = int(np.random.choice(np.flatnonzero(neighbor_difference == np.nanmax(neighbor_difference))))
-        # direction = int(np.nanargmax(neighbor_difference))
-
-        if neighbor_difference[direction] <= 0:
-            return
-
-        water_share = min(
-            self.water_level - 1,
-            (neighbor_difference[direction] + 0) // 2,
-            self.neighbors[direction].can_receive()
-        )
-
-        if water_share < 2:
-            return
-
-        self.neighbors[direction].received_water[direction] += water_share
-        self.given_water += water_share
-
-
-    def step_update(self, r, events, **kwargs):
-        self.water_level += sum(self.received_water) - self.given_water
-        self.flow = np.array((
-            self.received_water[0] - self.received_water[2],
-            self.received_water[1] - self.received_water[3],
-            self.received_water[2] - self.received_water[0],
-            self.received_water[3] - self.received_water[1]
-        ))
-        self.flow[self.slant < 0] = 0
-        self.received_water = [0, 0, 0, 0]
-        self.given_water = 0
-
-    def continuous_update(self, t, events, **kwargs):
-        pass
-
-    def draw(self, t, renderer, **kwargs):
-        # TODO: pass color lambdas
-        if self.water_level > 0:
-            # draw water
-            padding = 0
-            water_level = self.water_level/water_levels
-            glColor3f(*(color_water[:2] * np.cos(water_level * np.pi / 2)), 1 - 0.6 * water_level)
-            # TODO: draw flow arrow
-        else:
-            # draw ground
-            padding = 0.2
-            glColor3f(*(color_terrain * self.terrain_level/terrain_levels))
-
-        glBegin(GL_QUADS)
-        glVertex2fv((padding, padding))
-        glVertex2fv((1 - padding, padding))
-        glVertex2fv((1 - padding, 1 - padding))
-        glVertex2fv((padding, 1 - padding))
-        glEnd()
-
-
-class CellularWaterGrid(DrawableABC):
     def __init__(
         self,
         shape,
         water_levels=12,
         terrain_levels=6,
-        scale=8,
-        padding=0.2
+        source_rate=10,
+        chunk_size=32,
+        seed=None
     ):
         assert len(shape) == 2
         assert shape[0] > 1
         assert shape[1] > 1
-        self.scale = scale
-        self.padding = padding
-        self.color_ground = np.array((0.5, 0.45, 0.45))
-        self.color_water = np.array((0.3, 0.4, 1))
         self.shape = shape
         self.water_levels = water_levels
         self.terrain_levels = terrain_levels
+        self.source_rate = source_rate
+        self.chunk_size = chunk_size
+        self.round = 0
+        self._rng = np.random.default_rng(seed)
+        self._sources = set()
+        self._source_mask = np.zeros(self.shape, dtype=bool)
+        self.water_grid = np.zeros(self.shape)
+        self.flow = np.zeros((4, *self.shape))
+        # Bounding box of the cells with water, flow or a source
+        self._active = None
+        self.layers = None
+        self.set_terrain(*generate_terrain(self.shape, self.terrain_levels, seed=self._rng, compact=True))
+
+    def set_terrain(self, terrain, walls=None):
+        """
+        :param terrain: Integer terrain levels, or float levels with NaN walls if `walls` is not given
+        :param walls: Boolean wall mask
+        """
+        assert terrain.shape == self.shape
+        if walls is None:
+            if np.issubdtype(terrain.dtype, np.floating):
+                terrain, walls = compact_terrain(terrain)
+            else:
+                walls = np.zeros(self.shape, dtype=bool)
+        self.terrain_grid = terrain
+        self.walls = walls
+        self.terrain_levels = int(terrain[~walls].max(initial=0)) + 1
+        terrain = terrain.astype(float)
+        # Neighbors that exist and are not walls, per direction
+        self._neighbors = np.stack([shift(~walls, d, False) for d in range(4)]) & ~walls
+        self._n_neighbors = self._neighbors.sum(axis=0)
+        self.slant = np.stack([
+            np.where(self._neighbors[d], terrain - shift(terrain, d, 0), 0) for d in range(4)
+        ])
+        self.water_grid[walls] = 0
+        self.flow[:] = 0
+        self._active = bounding_box((self.water_grid > 0) | self._source_mask)
+        self.layers = ChunkedLayers(
+            self.terrain_grid,
+            self.water_grid,
+            self._sources,
+            self.terrain_levels,
+            self.water_levels,
+            chunk_size=self.chunk_size,
+            walls=self.walls
+        )
 
-        self.grid = np.zeros(self.shape, dtype="object")
-        self.cells = []
-        terrain = generate_terrain(self.shape, self.terrain_levels)
-        for (i, j) in np.ndindex(self.shape):
-            cell = Cell(self, (i, j), terrain[i, j], 0)
-            self.grid[i, j] = cell
-            self.cells.append(cell)
-        for cell in self.cells:
-            cell.initialize()
-
-        # self.grid[24, 23].water_level += 50
-        # self.grid[24, 24].water_level += 50
-
-    def get_neighbors(self, coords):
-        neighbors = {}
-        # Right
-        if coords[1] < self.shape[1] - 1:
-            neighbors[0] = self.grid[coords[0], coords[1]+1]
-        # Up
-        if coords[0] > 0:
-            neighbors[1] = self.grid[coords[0]-1, coords[1]]
-        # Left
-        if coords[1] > 0:
-            neighbors[2] = self.grid[coords[0], coords[1]-1]
-        # Down
-        if coords[0] < self.shape[0] - 1:
-            neighbors[3] = self.grid[coords[0]+1, coords[1]]
-
-        return neighbors
-
-    def step_update(self, r, inputs=None, **kwargs):
-        # self.grid[24, 23].water_level += 10
-        # self.grid[24, 24].water_level += 10
-        self.grid[40, 5].water_level += 10
-        self.grid[41, 6].water_level += 10
-        for cell in self.cells:
-            cell.calculate_step_update(r)
-        for cell in self.cells:
-            cell.step_update(r, None)
-
-    def continuous_update(self, t, inputs=None, **kwargs):
+    def add_source(self, coords):
+        if self.walls[coords]:
+            return
+        self._sources.add(coords)
+        self._source_mask[coords] = True
+        self._active = bounding_box((self.water_grid > 0) | self._source_mask)
+        self.layers.set_sources(self._sources, self.water_grid)
+
+    def step_update(self, r, events=None, **kwargs):
+        self.round = r
+        self.water_step(r)
+
+    def water_step(self, r):
+        if self._active is None:
+            return
+        r0, c0, r1, c1 = self._active
+        window = (
+            slice(max(r0 - 1, 0), min(r1 + 1, self.shape[0])),
+            slice(max(c0 - 1, 0), min(c1 + 1, self.shape[1]))
+        )
+        planes = (slice(None), *window)
+        shape = self.water_grid[window].shape
+        neighbors = self._neighbors[planes]
+        slant = self.slant[planes]
+        flow = self.flow[planes]
+
+        water = self.water_grid[window] + self.source_rate * self._source_mask[window]
+        level = water + self.terrain_grid[window]
+        received = np.zeros((4, *shape))
+        given = np.zeros(shape)
+
+        def capacity(direction):
+            # What the neighbor in `direction` can still receive
+            return shift(self.capacity - received.sum(axis=0), direction, 0)
+
+        def send(direction, amount):
+            nonlocal given
+            received[direction] += shift(amount, OPPOSITE[direction], 0)
+            given = given + amount
+
+        # 1) Flow
+        neighbor_flow = sum(shift(flow, d, 0) for d in range(4))
+        average_flow = (neighbor_flow + 0.1 * flow) / (self._n_neighbors[window] + 0.1)
+        flowing = water > 2
+        stopped = np.zeros(shape, dtype=bool)
+        for d in range(4):
+            stopped |= flowing & (water <= given)
+            amount = np.minimum.reduce([
+                np.ceil(water * 0.1) * average_flow[d] + slant[d],
+                water - given - 1,
+                capacity(d)
+            ])
+            passing = (
+                flowing & ~stopped & neighbors[d] & (average_flow[d] > 0)
+                & (slant[d] + 0.1 * water >= 0)
+            )
+            send(d, np.where(passing, np.maximum(amount, 0), 0))
+
+        # 2) Split the surplus with the lowest neighbor
+        neighbor_levels = np.stack([shift(level, d, 0) for d in range(4)])
+        difference = np.where(neighbors, level - neighbor_levels - given, -np.inf)
+        largest = difference.max(axis=0)
+        ties = np.where(difference == largest, self._rng.random(difference.shape), -1)
+        direction = ties.argmax(axis=0)
+        splitting = (water > 0) & ~stopped & (largest > 0)
+        for d in range(4):
+            share = np.minimum.reduce([water - given - 1, np.floor(largest / 2), capacity(d)])
+            send(d, np.where(splitting & (direction == d) & (share >= 2), share, 0))
+
+        new_water = water + received.sum(axis=0) - given
+        new_flow = received - received[list(OPPOSITE)]
+        new_flow[slant < 0] = 0
+        rows, cols = np.nonzero(new_water != self.water_grid[window])
+        self.water_grid[window] = new_water
+        self.flow[planes] = new_flow
+        self.layers.update(self.water_grid, (rows + window[0].start) * self.shape[1] + cols + window[1].start)
+
+        active = bounding_box((new_water > 0) | (new_flow != 0).any(axis=0) | self._source_mask[window])
+        if active is not None:
+            active = (
+                active[0] + window[0].start,
+                active[1] + window[1].start,
+                active[2] + window[0].start,
+                active[3] + window[1].start
+            )
+        self._active = active
+
+    def continuous_update(self, t, events=None, **kwargs):
         pass
 
-    def draw(self, t, renderer, **kwargs):
-        glPolygonMode(GL_FRONT, GL_FILL)
-        for (i, j) in np.ndindex(self.shape):
-            glPushMatrix()
-            glScale(self.scale, self.scale, 1)
-            glTranslate(i, j, 0)
-            cell: Cell = self.grid[i, j]
-            cell.draw(t, None, water_levels=self.water_levels, terrain_levels=self.terrain_levels)
-            glPopMatrix()
+    def draw(self, t, renderer, view=None, **kwargs):
+        """
+        :param view: (first row, first column, stop row, stop column) of the visible cells (default all)
+        """
+        renderer.draw_chunked_layers(t, self.layers, view)
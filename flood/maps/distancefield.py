@@ -0,0 +1,186 @@
+import numpy as np
+
+from . import kernels
+
+# Moves `downhill` chooses from: stay, up, down, left, right
+MOVES = np.array(((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)), dtype=np.intp)
+
+
+class DistanceField:
+    """
+    Distance Field
+    ===============
+
+    A Dijkstra map: the cost of the cheapest path from every cell to the nearest goal, over 4-neighbors.
+    Entering a cell costs 1 + `water_cost` per water level, walls and cells with more than `max_water`
+    water cannot be entered. The goals are the given cells, or the wet cells with `from_water`,
+    goals that cannot be entered are ignored. With `from_water`, entering water costs 1 + `water_cost`
+    at any depth, so the field only depends on which cells are wet and which are deeper than `max_water`.
+    With `flee`, the distances are multiplied by -`flee` and relaxed again, so that walking downhill
+    leads away from the goals but around dead ends rather than into them (flee maps).
+    Cells no goal reaches, or farther than `max_distance`, are inf.
+    One field serves any number of entities, each picks its move from the neighboring values with `downhill`.
+    The field is recomputed on the first access after a change that can affect it:
+    new goals, terrain, or water in the reached cells and their neighbors (with `from_water`, a cell
+    that got wet or dry or crossed `max_water`).
+    """
+    def __init__(
+        self,
+        terrain_grid,
+        walls,
+        goals=(),
+        from_water=False,
+        water_cost=1.0,
+        max_water=None,
+        flee=None,
+        max_distance=np.inf,
+        jit=True
+    ):
+        """
+        :param goals: Iterable of (row, column) goal cells
+        :param from_water: Use the wet cells as goals instead
+        :param water_cost: Extra cost of entering a cell per water level
+        :param max_water: Cells with more water cannot be entered (default no limit)
+        :param flee: Coefficient of flee maps, 1.2 is a good start (default none)
+        :param max_distance: Distance beyond which cells are not explored
+        :param jit: Use the numba kernel if numba is installed
+        """
+        self.shape = terrain_grid.shape
+        self.from_water = from_water
+        self.water_cost = water_cost
+        self.max_water = max_water
+        self.flee = flee
+        self.max_distance = max_distance
+        self.jit = jit and kernels.numba_available()
+        self.goals = frozenset()
+        self.water_grid = None
+        self.set_terrain(terrain_grid, walls)
+        self.set_goals(goals)
+
+    def set_terrain(self, terrain_grid, walls):
+        self.terrain_grid = terrain_grid
+        self.walls = walls
+        self._distance = None
+
+    def set_goals(self, goals):
+        """
+        :param goals: Iterable of (row, column) goal cells, ignored with `from_water`
+        """
+        goals = frozenset(tuple(int(x) for x in cell) for cell in goals)
+        if goals != self.goals:
+            self.goals = goals
+            if not self.from_water:
+                self._distance = None
+
+    def refresh(self, water_grid, cells=None):
+        """
+        Mark the field for recomputation if changed cells can affect it, the work is done on the next access
+        :param water_grid: Current water levels
+        :param cells: Flat indices of changed cells (default all cells)
+        """
+        self.water_grid = water_grid
+        if self._distance is None:
+            return
+        if cells is None:
+            self._distance = None
+            return
+        cells = np.asarray(cells, dtype=np.intp)
+        if len(cells) == 0:
+            return
+        if self.from_water:
+            water = np.asarray(water_grid).reshape(-1)[cells]
+            changed = (water > 0) != self._wet.reshape(-1)[cells]
+            if self.max_water is not None:
+                changed |= (water > self.max_water) != self._deep.reshape(-1)[cells]
+            if changed.any():
+                self._distance = None
+        elif self._region.reshape(-1)[cells].any():
+            self._distance = None
+
+    @property
+    def stale(self):
+        return self._distance is None
+
+    @property
+    def distance(self):
+        """
+        float array of the grid shape, recomputed if stale
+        """
+        if self._distance is None:
+            self._compute()
+        return self._distance
+
+    def _compute(self):
+        water = np.zeros(self.shape, dtype=np.uint8) if self.water_grid is None else np.asarray(self.water_grid)
+        wet = water > 0
+        deep = water > self.max_water if self.max_water is not None else np.zeros(self.shape, dtype=bool)
+        if self.from_water:
+            cost = np.where(wet, 1 + self.water_cost, 1.0).reshape(-1)
+        else:
+            cost = 1 + self.water_cost * water.reshape(-1).astype(float)
+        blocked = (self.walls | deep).reshape(-1)
+
+        distance = np.full(self.shape, np.inf)
+        if self.from_water:
+            distance[wet & ~self.walls] = 0
+        else:
+            for row, col in self.goals:
+                if 0 <= row < self.shape[0] and 0 <= col < self.shape[1] and not self.walls[row, col]:
+                    distance[row, col] = 0
+        distance = distance.reshape(-1)
+
+        dijkstra = kernels.compiled()["dijkstra"] if self.jit else kernels.dijkstra
+        heap = np.zeros(len(distance), dtype=np.int64)
+        position = np.full(len(distance), -1, dtype=np.int64)
+        state = np.zeros(1, dtype=np.int64)
+        dijkstra(distance, cost, blocked, self.shape[1], self.max_distance, heap, position, state)
+        if self.flee is not None:
+            # unreached cells stay inf, they must not become seeds
+            reached = np.isfinite(distance)
+            distance[reached] *= -self.flee
+            dijkstra(distance, cost, blocked, self.shape[1], np.inf, heap, position, state)
+
+        self._distance = distance.reshape(self.shape)
+        self._blocked = blocked.reshape(self.shape)
+        self._wet = wet
+        self._deep = deep
+        # Reached cells and their neighbors, water elsewhere cannot change the field
+        region = np.isfinite(self._distance)
+        region[1:] |= region[:-1].copy()
+        region[:-1] |= region[1:].copy()
+        region[:, 1:] |= region[:, :-1].copy()
+        region[:, :-1] |= region[:, 1:].copy()
+        self._region = region
+
+    def values(self, positions):
+        """
+        Distances at many positions at once
+        :param positions: Array of shape (n, 2), (row, column) coordinates, fractions are floored
+        :return: float array of shape (n,), inf outside the map
+        """
+        distance = self.distance
+        positions = np.floor(np.asarray(positions, dtype=float).reshape(-1, 2)).astype(np.intp)
+        rows, cols = positions[:, 0], positions[:, 1]
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        values = np.full(len(positions), np.inf)
+        values[inside] = distance[rows[inside], cols[inside]]
+        return values
+
+    def downhill(self, positions):
+        """
+        Best move of many entities at once: to the lowest of the cell and its open neighbors,
+        staying put on ties, so entities stop at the goals (or a local minimum of a flee map)
+        :param positions: Integer array of shape (n, 2), (row, column) coordinates
+        :return: Array of shape (n, 2), the cells to move to
+        """
+        distance = self.distance
+        positions = np.asarray(positions, dtype=np.intp).reshape(-1, 2)
+        targets = positions[:, None, :] + MOVES
+        rows, cols = targets[..., 0], targets[..., 1]
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        rows, cols = np.where(inside, rows, 0), np.where(inside, cols, 0)
+        values = np.where(inside & ~self._blocked[rows, cols], distance[rows, cols], np.inf)
+        # the current cell always counts, even if blocked
+        values[:, 0] = np.where(inside[:, 0], distance[rows[:, 0], cols[:, 0]], np.inf)
+        best = np.argmin(values, axis=1)
+        return targets[np.arange(len(positions)), best]
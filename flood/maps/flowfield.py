@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class FlowField:
+    """
+    Flow Field
+    ===========
+
+    Per-cell flow vectors (rows, columns) derived from the gradient of the water surface,
+    pointing from high to low surface. A vector is the central difference of the surface levels
+    of the four neighbors, walls and the map edge count as the level of the cell itself.
+    Dry cells and walls have no flow.
+    A changed cell only affects itself and its neighbors, so only those are recomputed.
+    """
+    def __init__(self, terrain_grid, walls):
+        self.shape = terrain_grid.shape
+        self.terrain_grid = terrain_grid
+        self.walls = walls
+        self.vectors = np.zeros((*self.shape, 2), dtype=np.float32)
+
+    def refresh(self, water_grid, cells=None):
+        """
+        Recompute the vectors around changed cells
+        :param water_grid: Current water levels
+        :param cells: Flat indices of changed cells (default all cells)
+        """
+        if cells is None:
+            rows, cols = np.indices(self.shape).reshape(2, -1)
+        else:
+            cells = np.asarray(cells, dtype=np.intp)
+            if len(cells) == 0:
+                return
+            rows, cols = np.unravel_index(cells, self.shape)
+            rows = np.concatenate((rows, rows - 1, rows + 1, rows, rows))
+            cols = np.concatenate((cols, cols, cols, cols - 1, cols + 1))
+            inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+            affected = np.unique(rows[inside] * self.shape[1] + cols[inside])
+            rows, cols = np.divmod(affected, self.shape[1])
+
+        def surface(rows, cols):
+            # only the cells needed, not the whole map
+            return water_grid[rows, cols].astype(np.int16) + self.terrain_grid[rows, cols]
+
+        center = surface(rows, cols)
+
+        def neighbor_surface(d_row, d_col):
+            n_rows, n_cols = rows + d_row, cols + d_col
+            inside = (n_rows >= 0) & (n_rows < self.shape[0]) & (n_cols >= 0) & (n_cols < self.shape[1])
+            n_rows, n_cols = np.where(inside, n_rows, rows), np.where(inside, n_cols, cols)
+            open_ = inside & ~self.walls[n_rows, n_cols]
+            return np.where(open_, surface(n_rows, n_cols), center)
+
+        wet = (water_grid[rows, cols] > 0) & ~self.walls[rows, cols]
+        self.vectors[rows, cols, 0] = np.where(wet, (neighbor_surface(-1, 0) - neighbor_surface(1, 0)) / 2, 0)
+        self.vectors[rows, cols, 1] = np.where(wet, (neighbor_surface(0, -1) - neighbor_surface(0, 1)) / 2, 0)
+
+    def drift(self, positions):
+        """
+        Flow vectors at many positions at once
+        :param positions: Array of shape (n, 2), (row, column) coordinates, fractions are floored
+        :return: float32 array of shape (n, 2), zero outside the map
+        """
+        positions = np.floor(np.asarray(positions, dtype=float).reshape(-1, 2)).astype(np.intp)
+        rows, cols = positions[:, 0], positions[:, 1]
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        drift = np.zeros((len(positions), 2), dtype=np.float32)
+        drift[inside] = self.vectors[rows[inside], cols[inside]]
+        return drift
@@ -1,13 +1,34 @@
+import copy
 import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-from OpenGL.GL import *
-import heapq
 
 from ..abc.drawable import DrawableABC
 from ..entities.abc import EntityABC
-from flood.renderer import Renderer
-from .utils import generate_terrain
+from ..geometry import ChunkedLayers
+from . import kernels
+from .waterbody import WaterBody
+from .flowfield import FlowField
+from .overview import Overview
+from .distancefield import DistanceField
+from .utils import generate_terrain, compact_terrain
+
+
+def _generator(state):
+    """
+    Random generator restored from the state of its bit generator
+    """
+    bit_generator = getattr(np.random, state["bit_generator"])()
+    bit_generator.state = state
+    return np.random.Generator(bit_generator)
+
+
+def _concatenate(buffers, dtype):
+    return np.concatenate([np.asarray(buffer, dtype=dtype) for buffer in buffers] or [np.zeros(0, dtype=dtype)])
 
 
 class FrExWaterGrid(EntityABC, DrawableABC):
@@ -16,11 +37,42 @@ class FrExWaterGrid(EntityABC, DrawableABC):
     ==============================
 
     Water always expands at the lowest unexpanded levels
+
+    Frontier entries are (level, cell) pairs, each pair is queued and expanded at most once.
+    Queued and explored levels of a cell are kept as bits of per-cell integers,
+    so the bookkeeping never outgrows the map: two uint64 bitmasks and an int32 union-find parent,
+    20 bytes per cell (about 335 MB for 4096 x 4096).
+    Every connected body of water has its own frontier and expands `expansions_per_round` times per round.
+    Cells belong to bodies through a union-find forest; when a body reaches a cell of another body,
+    the two bodies and their frontiers are merged. Bodies too far apart to touch within a round
+    can expand in parallel threads.
+    Expansions run in `kernels.expand` over flat arrays, compiled with numba if it is installed.
+    Terrain and water levels are stored as uint8, walls as a boolean mask.
+    `flow_field` and `drift` give the flow of the water surface, for dragging entities.
+    `overview` gives `overview_block` block summaries of the grid, for the minimap.
+    `add_distance_field` registers shared distance fields toward goals or away from water, for entities
+    to pick moves from, `distance_fields` gives them up to date with the water.
+    Random numbers come from a per-instance generator seeded with `seed`, each body gets its own child generator.
+    Drawing is split into `chunk_size` chunks, only visible chunks are built and only chunks
+    with changed cells are updated, so frame time follows the visible and active area, not the map size.
+    With a `frame_budget` (seconds), `step_update` only schedules a round and `continuous_update` does
+    its expansions in slices, as many as fit in the budget of each frame. A round is committed when all its
+    expansions are done; the result is the same as without a budget (parallel bodies run one after another).
     """
+    max_level = 63
+
     def __init__(
         self,
         shape,
-        depth_first_factor=1
+        depth_first_factor=1,
+        expansions_per_round=5,
+        verbose=True,
+        jit=True,
+        parallel=False,
+        chunk_size=32,
+        seed=None,
+        frame_budget=None,
+        overview_block=8
     ):
         assert len(shape) == 2
         assert shape[0] > 1
@@ -30,131 +82,644 @@ class FrExWaterGrid(EntityABC, DrawableABC):
         self.color_wave = np.array((0.7, 0.7, 1))
         self.shape = shape
         self.water_levels: int = 1
-        self.water_grid: np.ndarray = np.zeros(self.shape)
+        self.water_grid: np.ndarray = np.zeros(self.shape, dtype=np.uint8)
         self.terrain_levels: int = 1
-        self.terrain_grid: np.ndarray = np.zeros(self.shape)
+        self.terrain_grid: np.ndarray = np.zeros(self.shape, dtype=np.uint8)
+        self.walls: np.ndarray = np.zeros(self.shape, dtype=bool)
         self.depth_first_factor = depth_first_factor
+        self.expansions_per_round = expansions_per_round
+        self.verbose = verbose
+        self.jit = jit and kernels.numba_available()
+        self.parallel = parallel
+        self.chunk_size = chunk_size
+        self.frame_budget = frame_budget
+        self.overview_block = overview_block
+        self.round = 0
         self.total_steps = 0
+        # Functions called with the round number and the cells it changed when a round is committed,
+        # on the thread that ran it
+        self.round_listeners = []
+        self._round_changed = []
+        self.expansion_margin = 1 + 4 * (self.max_level + 1)
+        n_cells = self.shape[0] * self.shape[1]
         self._sources = set()
-        self._frontier = []
-        self._frontier_set = set()
-        self._explored = set()
+        self._source_mask = np.zeros(n_cells, dtype=bool)
+        self._rng = np.random.default_rng(seed)
+        # Water bodies by root cell, and the union-find forest of cells (-1 = no body)
+        self._bodies = {}
+        self._parent = np.full(n_cells, -1, dtype=np.int32)
+        self._executor = None
+        # Bit `level` is set if (cell, level) is queued / was expanded
+        self._queued = np.zeros(n_cells, dtype=np.uint64)
+        self._explored = np.zeros(n_cells, dtype=np.uint64)
+        # Rounds waiting for `continuous_update`, and [root, expansions done] of the bodies
+        # still to expand in the first of them
+        self._scheduled = deque()
+        self._round_work = None
+        # Estimated seconds per expansion, sizes the slices of scheduled work
+        self._expansion_time = 1e-5
+        # Cells changed since the last draw
+        self._dirty = set()
+        self.layers = None
+        # Cells changed since the flow field was refreshed, None to refresh all
+        self._flow_field = None
+        self._flow_dirty = None
+        # Cells changed since the overview was refreshed, None to refresh all
+        self._overview = None
+        self._overview_dirty = None
+        # Distance fields by name, and the cells changed since they were last given to the fields
+        self._distance_fields = {}
+        self._fields_dirty = []
+        # Flood prediction, see solve_flood
+        self.arrival_round: np.ndarray = None
+        self.equilibrium_level: np.ndarray = None
 
-    def set_terrain(self, terrain):
+    def set_terrain(self, terrain, walls=None):
+        """
+        :param terrain: Integer terrain levels, or float levels with NaN walls if `walls` is not given
+        :param walls: Boolean wall mask
+        """
         assert terrain.shape == self.shape
+        if walls is None:
+            if np.issubdtype(terrain.dtype, np.floating):
+                terrain, walls = compact_terrain(terrain)
+            else:
+                walls = np.zeros(self.shape, dtype=bool)
+        assert walls.shape == self.shape
         self.terrain_grid = terrain
-        self.terrain_levels = int(np.nanmax(terrain) - np.nanmin(terrain)) + 1
+        self.walls = walls
+        floor = terrain[~walls]
+        lowest, highest = (int(floor.min()), int(floor.max())) if floor.size else (0, 0)
+        self.terrain_levels = highest - lowest + 1
         self.water_levels = self.terrain_levels + 2
+        # Frontier entries one expansion can add at most: the source level
+        # and every level between the highest possible water surface and the lowest terrain for 4 neighbors
+        top_level = max(highest, self.terrain_levels + 2)
+        self.expansion_margin = 1 + 4 * (top_level - lowest + 2)
+        self.layers = ChunkedLayers(
+            self.terrain_grid,
+            self.water_grid,
+            self._sources,
+            self.terrain_levels,
+            self.water_levels,
+            chunk_size=self.chunk_size,
+            walls=self.walls
+        )
+        self._dirty.clear()
+        # built on first access, see flow_field
+        self._flow_field = None
+        self._flow_dirty = None
+        self._overview = Overview(
+            self.terrain_grid, self.walls, self.terrain_levels, self.water_levels, block=self.overview_block
+        )
+        self._overview_dirty = None
+        for field in self._distance_fields.values():
+            field.set_terrain(self.terrain_grid, self.walls)
+            field.refresh(self.water_grid)
+        self._fields_dirty = []
 
     def add_source(self, coords):
         self._sources.add(coords)
-        self.add_to_frontier(coords, self.water_grid[coords] + self.terrain_grid[coords])
+        self._source_mask[coords[0] * self.shape[1] + coords[1]] = True
+        if self.layers is not None:
+            self.layers.set_sources(self._sources, self.water_grid)
+        if self.walls[coords]:
+            return
+        self.add_to_frontier(coords, int(self.water_grid[coords]) + int(self.terrain_grid[coords]))
+
+    def remove_source(self, coords):
+        """
+        Stop a source from rising, the water it already added stays
+        """
+        self._sources.discard(coords)
+        self._source_mask[coords[0] * self.shape[1] + coords[1]] = False
+        if self.layers is not None:
+            self.layers.set_sources(self._sources, self.water_grid)
 
     def add_to_frontier(self, coords, level, delay=0):
-        if (level, coords) in self._explored:
-            return
-        if (level, coords) in self._frontier_set:
-            return
-        if level in (np.nan, None):
+        """
+        Queue a level of a cell in the frontier of the body that owns the cell,
+        a cell without a body starts a new one
+        """
+        if level is None or np.isnan(level) or not 0 <= level <= self.max_level:
             raise ValueError(f"Invalid value: {level}")
-        self._frontier_set.add((level, coords))
+        body = self.body_at(coords, create=True)
+        body.reserve(1)
+        push_frontier = kernels.compiled()["push_frontier"] if self.jit else kernels.push_frontier
+        push_frontier(
+            body.priority,
+            body.level,
+            body.index,
+            body.state,
+            self._queued,
+            self._explored,
+            body.random,
+            coords[0] * self.shape[1] + coords[1],
+            int(level),
+            delay,
+            self.depth_first_factor
+        )
 
-        # Lower value = higher priority
-        queue_value = level * (self.depth_first_factor + np.random.random() * delay)
+    def body_at(self, coords, create=False):
+        """
+        Water body that owns a cell
+        :param create: Start a new body if no body owns the cell
+        :return: WaterBody or None
+        """
+        cell = coords[0] * self.shape[1] + coords[1]
+        root = kernels.find(self._parent, cell)
+        if root >= 0:
+            return self._bodies[root]
+        if not create:
+            return None
+        self._parent[cell] = cell
+        body = self._bodies[cell] = WaterBody(cell, self.jit, np.random.default_rng(self._rng.integers(2**63)))
+        body.grow_bounds(np.array([coords[0]]), np.array([coords[1]]))
+        return body
 
+    @property
+    def bodies(self):
+        return list(self._bodies.values())
 
-        heapq.heappush(
-            self._frontier,
-            [
-                queue_value,
-                level,
-                coords
-            ]
-        )
+    @property
+    def frontier_size(self):
+        # a copy of the bodies, the simulation may run on another thread
+        return sum(len(body) for body in list(self._bodies.values()))
 
-    def frontier_pop(self):
-        _, level, coords = heapq.heappop(self._frontier)
-        self._frontier_set.remove((level, coords))
-        while (coords, level) in self._explored:
-            _, level, coords = heapq.heappop(self._frontier)
-            self._frontier_set.remove((level, coords))
-        self._explored.add((coords, level))
-        return coords, level
+    @property
+    def skipped_pops(self):
+        """
+        Frontier entries popped without an expansion, see `kernels.SKIPPED`
+        """
+        return sum(int(body.state[kernels.SKIPPED]) for body in list(self._bodies.values()))
+
+    @property
+    def explored_size(self):
+        """
+        Number of explored (level, cell) pairs, every pop explores a new one
+        """
+        return self.total_steps + self.skipped_pops
+
+    @property
+    def scheduled_rounds(self):
+        """
+        Number of rounds scheduled but not committed yet
+        """
+        return len(self._scheduled)
 
     def step_update(self, r, events, **kwargs):
-        n_steps = 5
-        for _ in range(n_steps):
-            self.water_step(r)
-        if r % 50 == 0:
+        if self.frame_budget is not None:
+            self._scheduled.append(r)
+            return
+        self.round = r
+        self.advance(self.expansions_per_round, r)
+        self._commit(r)
+
+    def continuous_update(self, t, events, **kwargs):
+        """
+        Do scheduled expansions for `frame_budget` seconds
+        """
+        if self._scheduled:
+            self._work_until(time.perf_counter() + self.frame_budget)
+
+    def flush(self):
+        """
+        Complete all scheduled rounds
+        """
+        self._work_until(None)
+
+    def _work_until(self, deadline):
+        """
+        Expand the bodies of scheduled rounds in order, in slices sized to end near `deadline`.
+        At least one slice runs per call, so slow devices still make progress.
+        :param deadline: `time.perf_counter` value, None to run until all rounds are committed
+        """
+        per_round = self.expansions_per_round
+        while self._scheduled:
+            r = self._scheduled[0]
+            if self._round_work is None:
+                active = sorted(root for root, body in self._bodies.items() if len(body))
+                self._round_work = [[root, 0] for root in reversed(active)]
+            while self._round_work:
+                root, done = self._round_work[-1]
+                body = self._bodies.get(root)
+                n = per_round - done
+                if deadline is not None:
+                    n = max(1, min(n, int((deadline - time.perf_counter()) / self._expansion_time)))
+                changed = ()
+                if body is not None:
+                    start = time.perf_counter()
+                    changed = self._expand(body, n, r, per_round, offset=done)
+                    if len(changed):
+                        elapsed = (time.perf_counter() - start) / len(changed)
+                        self._expansion_time = 0.8 * self._expansion_time + 0.2 * elapsed
+                    self._record([(r, changed)])
+                if body is None or len(changed) < n or done + n >= per_round:
+                    self._round_work.pop()
+                else:
+                    self._round_work[-1][1] += n
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+            self._round_work = None
+            self._scheduled.popleft()
+            self.round = r
+            self._commit(r)
+
+    def _commit(self, r):
+        """
+        Round `r` is complete
+        """
+        if self.round_listeners:
+            cells = np.concatenate(self._round_changed) if self._round_changed else np.zeros(0, dtype=np.intp)
+            self._round_changed = []
+            for listener in self.round_listeners:
+                listener(r, cells)
+        if self.verbose and r % 50 == 0:
             print(f"Round {r}, Water updates: {self.total_steps}")
 
+    def advance(self, n_expansions, r=None):
+        """
+        Run `n_expansions` frontier expansions of every body, a single kernel call per body
+        :param n_expansions: Number of expansions per body
+        :param r: Round number, delays new frontier entries at random (default: current round)
+        :return: Number of expansions done, fewer if frontiers run empty
+        """
+        if r is None:
+            r = self.round
+        # report the frontier running empty once, not on every call after
+        was_active = self.verbose and self.frontier_size > 0
+        changed = self._run(n_expansions, r, n_expansions, reach=n_expansions)
+        done = sum(len(cells) for _, cells in changed)
+        if was_active and self.frontier_size == 0:
+            print("frontier is empty")
+        return done
+
+    def fast_forward(self, n_rounds):
+        """
+        Run `n_rounds` rounds of expansions without drawing.
+        Bodies that cannot touch each other within the remaining rounds run them in a single kernel call.
+        :return: Number of expansions done
+        """
+        done = sum(len(cells) for _, cells in self._fast_forward(n_rounds))
+        return done
+
     def water_step(self, r):
-        self.total_steps += 1
-        priority = r
-        coords = None
-        while coords is None:
-            try:
-                coords, frontier_level = self.frontier_pop()
-            except IndexError:
-                print(f"index error: frontier is empty")
-                coords = None
-                return
-
-            this_level = self.water_grid[coords] + self.terrain_grid[coords]
-            if np.isnan(this_level):
-                coords = None
-
-        self.water_grid[coords] += 1
-        this_level += 1
-        if coords in self._sources and this_level < self.terrain_levels+2:  # water shouldn't rise above max_terrain+2
-            self.add_to_frontier(coords, this_level+1, priority)
-
-        # add neighbors
-        for neighbor in [
-            (coords[0] - 1, coords[1]),
-            (coords[0] + 1, coords[1]),
-            (coords[0], coords[1] - 1),
-            (coords[0], coords[1] + 1)
-        ]:
+        self.advance(1, r)
+
+    def _fast_forward(self, n_rounds):
+        """
+        :return: List of (first round, changed cells) per kernel run
+        """
+        runs = []
+        while n_rounds > 0:
+            window = max(1, min(n_rounds, self._independent_rounds()))
+            per_round = self.expansions_per_round
+            runs += self._run(window * per_round, self.round + 1, per_round, reach=window * per_round)
+            self.round += window
+            n_rounds -= window
+        return runs
+
+    def _independent_rounds(self):
+        """
+        Number of rounds in which no two bodies can touch.
+        A body that expands k times stays within its bounding box grown by k + 1.
+        """
+        bodies = [body for body in self._bodies.values() if body.bounds is not None]
+        gap = min(
+            (a.gap(b) for i, a in enumerate(bodies) for b in bodies[i + 1:]),
+            default=np.inf
+        )
+        if gap == np.inf:
+            return np.inf
+        return int(gap // 2 - 1) // self.expansions_per_round
+
+    def _run(self, n_expansions, r, expansions_per_round, reach):
+        """
+        Expand every body with a non-empty frontier. Bodies that cannot touch any other body within
+        `reach` expansions run in parallel if enabled, the others one after another.
+        :return: List of (first round, changed cells) per body
+        """
+        active = sorted(root for root, body in self._bodies.items() if len(body))
+        independent = []
+        if self.parallel and len(active) > 1:
+            bodies = list(self._bodies.values())
+            independent = [
+                root for root in active
+                if all(
+                    self._bodies[root].gap(other) >= 2 * (reach + 1)
+                    for other in bodies if other is not self._bodies[root]
+                )
+            ]
+            if len(independent) > 1:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+                futures = [
+                    self._executor.submit(self._expand, self._bodies[root], n_expansions, r, expansions_per_round)
+                    for root in independent
+                ]
+                runs = [(r, future.result()) for future in futures]
+            else:
+                independent = []
+        if not independent:
+            runs = []
+        for root in active:
+            if root in independent or root not in self._bodies:
+                continue
+            runs.append((r, self._expand(self._bodies[root], n_expansions, r, expansions_per_round)))
+        self._record(runs)
+        return runs
+
+    def _record(self, runs):
+        """
+        Count the changed cells of (first round, changed cells) runs and mark them for drawing and the flow field
+        """
+        for _, changed in runs:
+            self.total_steps += len(changed)
+            self._dirty.update(changed.tolist())
+            if self._flow_dirty is not None:
+                self._flow_dirty.append(changed)
+            if self._overview_dirty is not None:
+                self._overview_dirty.append(changed)
+            if self._distance_fields:
+                self._fields_dirty.append(changed)
+            if self.round_listeners:
+                self._round_changed.append(changed)
+
+    def _expand(self, body, n_expansions, r, expansions_per_round, offset=0):
+        """
+        Run the expansion kernel for one body, merging the bodies it touches
+        :param r: Round number of the first expansion
+        :param expansions_per_round: Round number grows by one every `expansions_per_round` expansions
+        :param offset: Expansions the body already did in round `r`
+        :return: Flat indices of the cells that got water, in order
+        """
+        water = self.water_grid.reshape(-1)
+        terrain = np.asarray(self.terrain_grid).reshape(-1)
+        walls = np.asarray(self.walls).reshape(-1)
+        changed = np.zeros(n_expansions, dtype=np.int64)
+        expand = kernels.compiled()["expand"] if self.jit else kernels.expand
+        body.state[kernels.EMPTY] = 0
+        done = 0
+        while done < n_expansions and not body.state[kernels.EMPTY]:
+            body.reserve(self.expansion_margin)
+            start = done
+            done += expand(
+                n_expansions - done,
+                r,
+                expansions_per_round,
+                offset + done,
+                self.shape[1],
+                water,
+                terrain,
+                walls,
+                self._source_mask,
+                self._queued,
+                self._explored,
+                self._parent,
+                body.root,
+                body.priority,
+                body.level,
+                body.index,
+                body.state,
+                body.random,
+                self.expansion_margin,
+                self.depth_first_factor,
+                self.terrain_levels + 2,  # water shouldn't rise above max_terrain+2
+                changed[done:]
+            )
+            if done > start:
+                body.grow_bounds(*np.divmod(changed[start:done], self.shape[1]))
+            if body.state[kernels.TOUCH]:
+                body.state[kernels.TOUCH] = 0
+                self._merge_around(body, changed[done - 1])
+        return changed[:done]
+
+    def _merge_around(self, body, cell):
+        """
+        Merge the bodies that own the neighbors of `cell` into `body`
+        """
+        row, col = divmod(int(cell), self.shape[1])
+        for neighbor in [(row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)]:
             if not ((0 <= neighbor[0] < self.shape[0]) and (0 <= neighbor[1] < self.shape[1])):
                 continue
-            neighbor_level = self.water_grid[neighbor] + self.terrain_grid[neighbor]
-            if np.isnan(neighbor_level):
+            root = kernels.find(self._parent, neighbor[0] * self.shape[1] + neighbor[1])
+            if root < 0 or root == body.root:
                 continue
-            difference = this_level - neighbor_level
-            # TODO: prioritize expansion down steep slopes
-            neighbor_priority = -1 if difference > 1 else priority
-            for i in range(int(difference)):
-                self.add_to_frontier(neighbor, neighbor_level+i, neighbor_priority)
+            self._parent[root] = body.root
+            body.merge(self._bodies.pop(root))
 
-    def continuous_update(self, t, events, **kwargs):
-        pass
-
-    def draw(self, t, renderer: Renderer, **kwargs):
-        glPolygonMode(GL_FRONT, GL_FILL)
-        # glLineWidth(0.1)
-        for coords in np.ndindex(self.shape):
-            (i, j) = coords
-            if np.isnan(self.terrain_grid[i, j]):
-                continue
-            if (i, j) in self._sources:
-                water_level = (self.water_grid[i, j] - 1)/self.water_levels
-                renderer.draw(t, coords, "water", water_level=water_level)
-                renderer.draw(t, coords, "water_source")
-            elif self.water_grid[i, j] > 0:
-                water_level = (self.water_grid[i, j] - 1)/self.water_levels
-                total_level = (
-                    self.terrain_grid[i, j] + self.water_grid[i, j] - 1
-                ) / (self.terrain_levels + 2)  # water shouldn't rise above max_terrain+2
-                renderer.draw(t, coords, "water", water_level=water_level)
-                renderer.draw(t, coords, "water_wave", total_level=total_level)
-            else:
-                terrain_level = (self.terrain_grid[i, j] - 1)/self.terrain_levels
-                renderer.draw(t, coords, "ground", terrain_level=terrain_level)
+    @property
+    def flow_field(self):
+        """
+        FlowField of the water surface, refreshed around the cells changed since the last access
+        """
+        if self._flow_field is None:
+            self._flow_field = FlowField(self.terrain_grid, self.walls)
+            self._flow_dirty = None
+        if self._flow_dirty is None:
+            self._flow_field.refresh(self.water_grid)
+        elif self._flow_dirty:
+            self._flow_field.refresh(self.water_grid, np.concatenate(self._flow_dirty))
+        self._flow_dirty = []
+        return self._flow_field
+
+    @property
+    def overview(self):
+        """
+        Overview of the grid, refreshed around the cells changed since the last access
+        """
+        if self._overview_dirty is None:
+            self._overview.refresh(self.water_grid)
+        elif self._overview_dirty:
+            self._overview.refresh(self.water_grid, np.concatenate(self._overview_dirty))
+        self._overview_dirty = []
+        return self._overview
+
+    def add_distance_field(self, name, goals=(), **kwargs):
+        """
+        Register a distance field shared by all entities, see DistanceField for the arguments
+        :return: The field, recomputed lazily when its goals or the water in its region change
+        """
+        field = DistanceField(self.terrain_grid, self.walls, goals, jit=self.jit, **kwargs)
+        field.refresh(self.water_grid)
+        self._distance_fields[name] = field
+        return field
+
+    @property
+    def distance_fields(self):
+        """
+        Distance fields by name, invalidated by the cells changed since the last access
+        """
+        if self._fields_dirty:
+            cells = np.concatenate(self._fields_dirty)
+            for field in self._distance_fields.values():
+                field.refresh(self.water_grid, cells)
+        self._fields_dirty = []
+        return self._distance_fields
+
+    def drift(self, positions):
+        """
+        Flow vectors at many positions at once, see FlowField.drift
+        :param positions: Array of shape (n, 2), (row, column) coordinates
+        :return: Array of shape (n, 2)
+        """
+        return self.flow_field.drift(positions)
+
+    def get_state(self):
+        """
+        Complete simulation state, see `flood.snapshot`. Scheduled rounds are completed first.
+        :return: (meta, arrays), a JSON-serializable dict and a dict of numpy arrays
+        """
+        self.flush()
+        bodies = [self._bodies[root] for root in sorted(self._bodies)]
+        randoms = [np.asarray(body.random[body.state[kernels.RANDOM_POS]:], dtype=float) for body in bodies]
+        meta = {
+            "shape": list(self.shape),
+            "depth_first_factor": self.depth_first_factor,
+            "expansions_per_round": self.expansions_per_round,
+            "chunk_size": self.chunk_size,
+            "round": self.round,
+            "total_steps": self.total_steps,
+            "sources": sorted([int(i) for i in coords] for coords in self._sources),
+            "bodies": [
+                {
+                    "root": int(body.root),
+                    "size": len(body),
+                    "random": len(random),
+                    "bounds": None if body.bounds is None else [int(i) for i in body.bounds],
+                    "skipped": int(body.state[kernels.SKIPPED]),
+                    "rng": body.rng.bit_generator.state,
+                }
+                for body, random in zip(bodies, randoms)
+            ],
+            "rng": self._rng.bit_generator.state,
+        }
+        arrays = {
+            "terrain": self.terrain_grid,
+            "walls": self.walls,
+            "water": self.water_grid,
+            "queued": self._queued,
+            "explored": self._explored,
+            "parent": self._parent,
+            "frontier_priority": _concatenate([body.priority[:len(body)] for body in bodies], float),
+            "frontier_level": _concatenate([body.level[:len(body)] for body in bodies], np.int64),
+            "frontier_index": _concatenate([body.index[:len(body)] for body in bodies], np.int64),
+            "frontier_random": _concatenate(randoms, float),
+        }
+        return meta, arrays
+
+    def set_state(self, meta, arrays):
+        """
+        Restore a state returned by `get_state`. The arrays are used as they are, memory-mapped arrays stay mapped.
+        """
+        self.shape = tuple(meta["shape"])
+        self.depth_first_factor = meta["depth_first_factor"]
+        self.expansions_per_round = meta["expansions_per_round"]
+        self.chunk_size = meta["chunk_size"]
+        self.round = meta["round"]
+        self.total_steps = meta["total_steps"]
+        self.water_grid = arrays["water"]
+        self._queued = arrays["queued"].reshape(-1)
+        self._explored = arrays["explored"].reshape(-1)
+        self._parent = arrays["parent"].reshape(-1)
+        self._sources = {tuple(coords) for coords in meta["sources"]}
+        self._source_mask = np.zeros(self.shape[0] * self.shape[1], dtype=bool)
+        for row, col in self._sources:
+            self._source_mask[row * self.shape[1] + col] = True
+        self.set_terrain(arrays["terrain"], arrays["walls"])
+        self._rng = _generator(meta["rng"])
+
+        self._bodies = {}
+        entry, position = 0, 0
+        for body_meta in meta["bodies"]:
+            body = WaterBody(body_meta["root"], self.jit, _generator(body_meta["rng"]))
+            size, n_random = body_meta["size"], body_meta["random"]
+            for name in ("priority", "level", "index"):
+                buffer = arrays["frontier_" + name][entry:entry + size]
+                setattr(body, name, buffer.copy() if self.jit else buffer.tolist())
+            random = arrays["frontier_random"][position:position + n_random]
+            body.random = random.copy() if self.jit else random.tolist()
+            body.state[kernels.SIZE] = size
+            body.state[kernels.SKIPPED] = body_meta.get("skipped", 0)
+            if body_meta["bounds"] is not None:
+                body.bounds = tuple(body_meta["bounds"])
+            self._bodies[body.root] = body
+            entry += size
+            position += n_random
+        self._scheduled.clear()
+        self._round_work = None
+        self.arrival_round = None
+        self.equilibrium_level = None
+        self._flow_dirty = None
+        self._round_changed = []
+
+    def solve_flood(self, chunk_rounds=4096):
+        """
+        Predict the rest of the flood from the current state in one pass, after completing scheduled rounds.
+        Runs the expansion kernel on a copy of the grid, with copies of the random states,
+        until all frontiers are empty. Stores and returns
+        `arrival_round`, the round in which each cell first gets water (current round for wet cells,
+        inf for cells that stay dry, NaN for walls) and `equilibrium_level`, the final water surface
+        (terrain level for dry cells).
+        :param chunk_rounds: Maximum number of rounds per kernel call
+        :return: (arrival_round, equilibrium_level)
+        """
+        self.flush()
+        grid = copy.copy(self)
+        grid.water_grid = self.water_grid.copy()
+        grid._queued = self._queued.copy()
+        grid._explored = self._explored.copy()
+        grid._parent = self._parent.copy()
+        grid._bodies = {root: body.copy() for root, body in self._bodies.items()}
+        grid._rng = copy.deepcopy(self._rng)
+        grid._dirty = set()
+        grid._flow_dirty = None
+        grid._overview_dirty = None
+        grid._distance_fields = {}
+        grid._fields_dirty = []
+        grid.round_listeners = []
+        grid._round_changed = []
+        grid.verbose = False
+
+        cells, rounds = [], []
+        while grid.frontier_size:
+            for first_round, changed in grid._fast_forward(chunk_rounds):
+                cells.append(changed)
+                rounds.append(first_round + np.arange(len(changed)) // self.expansions_per_round)
+
+        arrival = np.full(self.shape[0] * self.shape[1], np.inf)
+        arrival[self.water_grid.reshape(-1) > 0] = self.round
+        if cells:
+            cells, rounds = np.concatenate(cells), np.concatenate(rounds)
+            # runs are not in round order when bodies ran several rounds in one call
+            order = np.lexsort((np.arange(len(rounds)), rounds))
+            cells, first = np.unique(cells[order], return_index=True)
+            new = ~(arrival[cells] <= self.round)
+            arrival[cells[new]] = rounds[order][first[new]]
+        arrival = arrival.reshape(self.shape)
+        arrival[self.walls] = np.nan
+
+        self.arrival_round = arrival
+        self.equilibrium_level = np.where(self.walls, np.nan, grid.water_grid.astype(int) + self.terrain_grid)
+        return self.arrival_round, self.equilibrium_level
+
+    def draw(self, t, renderer, view=None, **kwargs):
+        """
+        :param view: (first row, first column, stop row, stop column) of the visible cells (default all)
+        """
+        if self.layers is None:
+            return
+        if self._dirty:
+            self.layers.update(self.water_grid, np.fromiter(self._dirty, dtype=np.intp))
+            self._dirty.clear()
+        renderer.draw_chunked_layers(t, self.layers, view)
 
 
 if __name__ == "__main__":
     import pygame as pg
+    from OpenGL.GL import *
+    from flood.renderer import Renderer
+
     window_size = (800, 640)
     view_size = np.array((320, 320))
     display_compensation = (1, window_size[0]/window_size[1], 1)
@@ -169,14 +734,15 @@ if __name__ == "__main__":
         shape=shape,
         depth_first_factor=5
     )
-    terrain = generate_terrain(
+    terrain, walls = generate_terrain(
         shape=shape,
         levels=8,
         preset="perlin",
         cave=0.4,
-        extra_cave=0.3
+        extra_cave=0.3,
+        compact=True
     )
-    grid.set_terrain(terrain)
+    grid.set_terrain(terrain, walls)
     grid.add_source((10, 20))
     grid.add_source((30, 30))
 
@@ -205,7 +771,7 @@ if __name__ == "__main__":
         # Compensate display ratio distortion
         glScale(*display_compensation)
 
-        grid.draw(t, None)
+        grid.draw(t, renderer)
 
         glPopMatrix()
         pg.display.flip()
@@ -0,0 +1,349 @@
+"""
+Water expansion kernels
+========================
+
+Frontier expansion and distance fields over flat arrays. Every function is plain Python over numpy arrays
+and scalars, so the same source is compiled with numba when it is installed.
+The compiled and the pure Python kernel produce identical results.
+Numba is imported and the kernels compiled on first use only.
+"""
+import importlib.util
+import types
+
+import numpy as np
+
+# Slots of the frontier state array
+SIZE = 0
+RANDOM_POS = 1
+EMPTY = 2
+TOUCH = 3
+# Popped entries that were not expanded, each (level, cell) is queued at most once
+# so only entries of cells that became walls count
+SKIPPED = 4
+
+# BITS[level] marks a level in the queued and explored bitmasks
+BITS = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))
+
+
+def _less(p1, l1, i1, p2, l2, i2):
+    """
+    Entry order: priority, then level, then cell index
+    """
+    if p1 != p2:
+        return p1 < p2
+    if l1 != l2:
+        return l1 < l2
+    return i1 < i2
+
+
+def heap_push(priority, level, index, state, p, l, i):
+    pos = state[SIZE]
+    state[SIZE] += 1
+    while pos > 0:
+        parent = (pos - 1) // 2
+        if not _less(p, l, i, priority[parent], level[parent], index[parent]):
+            break
+        priority[pos] = priority[parent]
+        level[pos] = level[parent]
+        index[pos] = index[parent]
+        pos = parent
+    priority[pos] = p
+    level[pos] = l
+    index[pos] = i
+
+
+def heap_pop(priority, level, index, state):
+    """
+    Remove the top entry
+    :return: (level, index) of the removed entry
+    """
+    top_level = level[0]
+    top_index = index[0]
+    size = state[SIZE] - 1
+    state[SIZE] = size
+    p = priority[size]
+    l = level[size]
+    i = index[size]
+    pos = 0
+    while True:
+        child = 2 * pos + 1
+        if child >= size:
+            break
+        if child + 1 < size and _less(
+            priority[child + 1], level[child + 1], index[child + 1],
+            priority[child], level[child], index[child]
+        ):
+            child += 1
+        if not _less(priority[child], level[child], index[child], p, l, i):
+            break
+        priority[pos] = priority[child]
+        level[pos] = level[child]
+        index[pos] = index[child]
+        pos = child
+    priority[pos] = p
+    level[pos] = l
+    index[pos] = i
+    return top_level, top_index
+
+
+def find(parent, cell):
+    """
+    Root cell of the water body that owns `cell`, -1 if no body does
+    """
+    if parent[cell] < 0:
+        return -1
+    while parent[cell] != cell:
+        # path halving
+        parent[cell] = parent[parent[cell]]
+        cell = parent[cell]
+    return cell
+
+
+def push_frontier(
+    priority, level, index, state, queued, explored, random,
+    cell, cell_level, delay, depth_first_factor
+):
+    """
+    Queue (cell, level) unless it is already queued or was expanded
+    """
+    if cell_level < 0 or cell_level > 63:
+        raise ValueError("Invalid frontier level")
+    bit = BITS[cell_level]
+    if (queued[cell] | explored[cell]) & bit:
+        return
+    queued[cell] |= bit
+    # Lower value = higher priority
+    p = cell_level * (depth_first_factor + random[state[RANDOM_POS]] * delay)
+    state[RANDOM_POS] += 1
+    heap_push(priority, level, index, state, p, cell_level, cell)
+
+
+def expand(
+    n_expansions, r, expansions_per_round, offset, width, water, terrain, walls, sources, queued, explored,
+    parent, root, priority, level, index, state, random, margin,
+    depth_first_factor, max_level, changed
+):
+    """
+    Run up to `n_expansions` frontier expansions of one water body
+    :param r: Round number of the first expansion, used as the random delay of new frontier entries
+    :param expansions_per_round: The round number grows by one every `expansions_per_round` expansions
+    :param offset: Number of expansions already done in round `r`
+    :param width: Number of columns of the grid
+    :param water: Flat integer water levels, modified in place
+    :param terrain: Flat integer terrain levels
+    :param walls: Flat boolean wall mask
+    :param sources: Flat boolean source mask
+    :param queued: Flat bitmasks of queued levels
+    :param explored: Flat bitmasks of expanded levels
+    :param parent: Union-find forest of water bodies over cells, -1 for cells no body owns
+    :param root: Root cell of the expanding body
+    :param priority, level, index: Frontier heap arrays of the body
+    :param state: Frontier state (heap size, position in `random`, empty flag, touch flag, skipped pops)
+    :param random: Random numbers in [0, 1) consumed by new frontier entries
+    :param margin: Number of frontier entries one expansion can add at most
+    :param depth_first_factor: See FrExWaterGrid
+    :param max_level: Sources stop rising at this level
+    :param changed: Output, flat indices of the cells that got water
+    :return: Number of expansions done. Stops early when the heap or the random numbers
+        run short of `margin`, when the frontier is empty (sets the empty flag)
+        or after an expansion that reached a cell of another body (sets the touch flag).
+    """
+    n_cells = water.shape[0]
+    done = 0
+    while done < n_expansions and not state[TOUCH]:
+        if len(priority) - state[SIZE] < margin or len(random) - state[RANDOM_POS] < margin:
+            break
+
+        cell = -1
+        while state[SIZE] > 0:
+            top_level, top_index = heap_pop(priority, level, index, state)
+            bit = BITS[top_level]
+            queued[top_index] &= ~bit
+            explored[top_index] |= bit
+            if not walls[top_index]:
+                cell = top_index
+                break
+            state[SKIPPED] += 1
+        if cell < 0:
+            state[EMPTY] = 1
+            break
+
+        round_number = r + (offset + done) // expansions_per_round
+        water[cell] += 1
+        changed[done] = cell
+        done += 1
+        this_level = int(water[cell]) + int(terrain[cell])
+        if sources[cell] and this_level < max_level:
+            push_frontier(
+                priority, level, index, state, queued, explored, random,
+                cell, this_level + 1, round_number, depth_first_factor
+            )
+
+        # add neighbors
+        row = cell // width
+        col = cell % width
+        for k in range(4):
+            if k == 0:
+                if row == 0:
+                    continue
+                neighbor = cell - width
+            elif k == 1:
+                if cell + width >= n_cells:
+                    continue
+                neighbor = cell + width
+            elif k == 2:
+                if col == 0:
+                    continue
+                neighbor = cell - 1
+            else:
+                if col == width - 1:
+                    continue
+                neighbor = cell + 1
+            if walls[neighbor]:
+                continue
+            neighbor_level = int(water[neighbor]) + int(terrain[neighbor])
+            # Levels may be unsigned, compare before subtracting
+            if this_level < neighbor_level + 1:
+                continue
+            difference = this_level - neighbor_level
+            if parent[neighbor] < 0:
+                parent[neighbor] = root
+            elif find(parent, neighbor) != root:
+                state[TOUCH] = 1
+            # TODO: prioritize expansion down steep slopes
+            neighbor_priority = -1 if difference > 1 else round_number
+            for i in range(difference):
+                push_frontier(
+                    priority, level, index, state, queued, explored, random,
+                    neighbor, neighbor_level + i, neighbor_priority, depth_first_factor
+                )
+    return done
+
+
+def field_push(heap, position, state, distance, cell):
+    """
+    Insert a cell into an indexed heap ordered by `distance`, or move it up after its distance decreased
+    """
+    pos = position[cell]
+    if pos < 0:
+        pos = state[SIZE]
+        state[SIZE] += 1
+    key = distance[cell]
+    while pos > 0:
+        parent = (pos - 1) // 2
+        other = heap[parent]
+        if distance[other] <= key:
+            break
+        heap[pos] = other
+        position[other] = pos
+        pos = parent
+    heap[pos] = cell
+    position[cell] = pos
+
+
+def field_pop(heap, position, state, distance):
+    """
+    Remove the cell with the lowest distance
+    """
+    top = heap[0]
+    position[top] = -1
+    size = state[SIZE] - 1
+    state[SIZE] = size
+    if size > 0:
+        last = heap[size]
+        key = distance[last]
+        pos = 0
+        while True:
+            child = 2 * pos + 1
+            if child >= size:
+                break
+            if child + 1 < size and distance[heap[child + 1]] < distance[heap[child]]:
+                child += 1
+            if distance[heap[child]] >= key:
+                break
+            heap[pos] = heap[child]
+            position[heap[pos]] = pos
+            pos = child
+        heap[pos] = last
+        position[last] = pos
+    return top
+
+
+def dijkstra(distance, cost, blocked, width, max_distance, heap, position, state):
+    """
+    Lower distances to the cheapest path from any open cell with a finite distance, entering a cell costs `cost`
+    :param distance: Flat float distances, the seeds are finite and the other cells inf, modified in place.
+        Finite distances of blocked cells are left as they are and do not spread
+    :param cost: Flat positive cost of entering each cell
+    :param blocked: Flat boolean mask of cells that cannot be entered
+    :param width: Number of columns of the grid
+    :param max_distance: Cells farther than this stay inf
+    :param heap: Flat int64 work array of the size of the grid
+    :param position: Flat int64 work array of the size of the grid, all -1
+    :param state: Heap state, (size,)
+    :return: Number of cells settled
+    """
+    n_cells = distance.shape[0]
+    state[SIZE] = 0
+    for cell in range(n_cells):
+        if distance[cell] < np.inf and not blocked[cell]:
+            field_push(heap, position, state, distance, cell)
+    settled = 0
+    while state[SIZE] > 0:
+        cell = field_pop(heap, position, state, distance)
+        settled += 1
+        row = cell // width
+        col = cell % width
+        for k in range(4):
+            if k == 0:
+                if row == 0:
+                    continue
+                neighbor = cell - width
+            elif k == 1:
+                if cell + width >= n_cells:
+                    continue
+                neighbor = cell + width
+            elif k == 2:
+                if col == 0:
+                    continue
+                neighbor = cell - 1
+            else:
+                if col == width - 1:
+                    continue
+                neighbor = cell + 1
+            if blocked[neighbor]:
+                continue
+            new_distance = distance[cell] + cost[neighbor]
+            if new_distance < distance[neighbor] and new_distance <= max_distance:
+                distance[neighbor] = new_distance
+                field_push(heap, position, state, distance, neighbor)
+    return settled
+
+
+_compiled = None
+
+
+def numba_available():
+    return importlib.util.find_spec("numba") is not None
+
+
+def compiled():
+    """
+    Kernels compiled with numba into a separate namespace, so that the module-level functions stay plain Python
+    :return: Dict of compiled functions by name
+    """
+    global _compiled
+    if _compiled is None:
+        import numba
+        namespace = dict(globals())
+        for name in (
+            "_less", "heap_push", "heap_pop", "find", "push_frontier", "expand",
+            "field_push", "field_pop", "dijkstra"
+        ):
+            func = namespace[name]
+            # nogil: bodies that cannot touch each other expand in parallel threads
+            namespace[name] = numba.njit(cache=True, nogil=True)(
+                types.FunctionType(func.__code__, namespace, name, func.__defaults__)
+            )
+        _compiled = namespace
+    return _compiled
@@ -0,0 +1,85 @@
+import numpy as np
+
+from ..geometry import Ground, Water, floor_mask
+
+
+class Overview:
+    """
+    Overview
+    =========
+
+    Block-reduced summaries of a water grid, for the minimap. Per `block` x `block` cells:
+    the mean terrain level and the fraction of floor cells (fixed), the highest water level
+    and the fraction of floor cells that are flooded. Blocks at the map edge are partial.
+    A refresh reduces only the blocks of the changed cells, gathered into one (blocks, block, block) array.
+    `image` holds one RGB pixel per block in screen orientation, blocks are recolored when they change.
+    """
+    def __init__(self, terrain_grid, walls, terrain_levels, water_levels, block=8):
+        self.shape = terrain_grid.shape
+        self.block = block
+        self.terrain_levels = terrain_levels
+        self.water_levels = water_levels
+        self.blocks_shape = tuple(-(-size // block) for size in self.shape)
+        self.terrain_grid = terrain_grid
+        self.floor = floor_mask(terrain_grid, walls)
+
+        every_block = tuple(np.indices(self.blocks_shape).reshape(2, -1))
+        floor, terrain = self._gather(every_block, self.floor, terrain_grid)
+        floor_count = floor.sum(axis=(1, 2))
+        self.floor_fraction = (floor_count / block ** 2).reshape(self.blocks_shape)
+        self.terrain = (
+            np.where(floor, terrain, 0).sum(axis=(1, 2)) / np.maximum(floor_count, 1)
+        ).reshape(self.blocks_shape)
+        self._floor_count = floor_count.reshape(self.blocks_shape)
+        self.max_water = np.zeros(self.blocks_shape, dtype=np.uint8)
+        self.flooded = np.zeros(self.blocks_shape, dtype=np.float32)
+        self.image = np.zeros((self.blocks_shape[1], self.blocks_shape[0], 3), dtype=np.uint8)
+        self._recolor(every_block)
+
+    def _gather(self, blocks, *grids):
+        """
+        Cells of the given blocks, cells past the map edge repeat the last cell and are outside `floor`
+        :param blocks: (block rows, block columns) arrays
+        :return: Per grid an array of shape (n_blocks, block, block)
+        """
+        offsets = np.arange(self.block)
+        rows = blocks[0][:, None] * self.block + offsets
+        cols = blocks[1][:, None] * self.block + offsets
+        inside = (rows < self.shape[0])[:, :, None] & (cols < self.shape[1])[:, None, :]
+        rows = np.minimum(rows, self.shape[0] - 1)[:, :, None]
+        cols = np.minimum(cols, self.shape[1] - 1)[:, None, :]
+        return [
+            grid[rows, cols] & inside if grid.dtype == bool else grid[rows, cols]
+            for grid in grids
+        ]
+
+    def refresh(self, water_grid, cells=None):
+        """
+        Reduce the blocks around changed cells
+        :param water_grid: Current water levels
+        :param cells: Flat indices of changed cells (default all cells)
+        """
+        if cells is None:
+            blocks = tuple(np.indices(self.blocks_shape).reshape(2, -1))
+        else:
+            cells = np.asarray(cells, dtype=np.intp)
+            if len(cells) == 0:
+                return
+            rows, cols = np.divmod(cells, self.shape[1])
+            flat = np.unique((rows // self.block) * self.blocks_shape[1] + cols // self.block)
+            blocks = np.divmod(flat, self.blocks_shape[1])
+        floor, water = self._gather(blocks, self.floor, water_grid)
+        water = np.where(floor, water, 0)
+        self.max_water[blocks] = water.max(axis=(1, 2))
+        self.flooded[blocks] = (water > 0).sum(axis=(1, 2)) / np.maximum(self._floor_count[blocks], 1)
+        self._recolor(blocks)
+
+    def _recolor(self, blocks):
+        terrain_level = (self.terrain[blocks] - 1) / self.terrain_levels
+        water_level = (self.max_water[blocks].astype(np.float32) - 1) / self.water_levels
+        flooded = self.flooded[blocks][:, None]
+        colors = (1 - flooded) * Ground.colors(terrain_level=terrain_level) \
+            + flooded * Water.colors(water_level=water_level)
+        # rock shows dark
+        colors *= self.floor_fraction[blocks][:, None]
+        self.image[blocks[1], blocks[0]] = np.round(np.clip(colors, 0, 1) * 255)
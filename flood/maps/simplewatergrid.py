@@ -1,5 +1,4 @@
 import numpy as np
-from OpenGL.GL import *
 from flood.abc.drawable import DrawableABC
 import heapq
 
@@ -79,25 +78,31 @@ class SimpleWaterGrid(EntityABC, DrawableABC):
     def continuous_update(self, t, events, **kwargs):
         pass
 
-    def draw(self, t, renderer, **kwargs):
-        glPolygonMode(GL_FRONT, GL_FILL)
-        for (i, j) in np.ndindex(self.shape):
+    def draw(self, t, renderer, view=None, **kwargs):
+        """
+        :param view: (first row, first column, stop row, stop column) of the visible cells (default all)
+        """
+        from OpenGL import GL
+        GL.glPolygonMode(GL.GL_FRONT, GL.GL_FILL)
+        row0, col0, row1, col1 = view if view is not None else (0, 0, *self.shape)
+        for (i, j) in np.ndindex(self.water_grid[row0:row1, col0:col1].shape):
+            i, j = i + row0, j + col0
             if self.water_grid[i, j] > 0:
                 padding = 0
                 water_level = min(self.water_grid[i, j]/self.water_levels, 1)
-                glColor3f(*(self.color_water[:2] * np.cos(water_level * np.pi/2)), 1 - 0.6*water_level)
+                GL.glColor3f(*(self.color_water[:2] * np.cos(water_level * np.pi/2)), 1 - 0.6*water_level)
             else:
                 padding = self.padding
-                glColor3f(*(self.color_ground * self.terrain_grid[i, j]/self.terrain_levels))
-            glPushMatrix()
-            glScale(self.scale, self.scale, 1)
-            glTranslate(i, j, 0)
+                GL.glColor3f(*(self.color_ground * self.terrain_grid[i, j]/self.terrain_levels))
+            GL.glPushMatrix()
+            GL.glScale(self.scale, self.scale, 1)
+            GL.glTranslate(i, j, 0)
 
-            glBegin(GL_QUADS)
-            glVertex2fv((padding, padding))
-            glVertex2fv((1-padding, padding))
-            glVertex2fv((1-padding, 1-padding))
-            glVertex2fv((padding, 1-padding))
-            glEnd()
+            GL.glBegin(GL.GL_QUADS)
+            GL.glVertex2fv((padding, padding))
+            GL.glVertex2fv((1-padding, padding))
+            GL.glVertex2fv((1-padding, 1-padding))
+            GL.glVertex2fv((padding, 1-padding))
+            GL.glEnd()
 
-            glPopMatrix()
+            GL.glPopMatrix()
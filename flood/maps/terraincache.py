@@ -0,0 +1,85 @@
+import hashlib
+import os
+
+import numpy as np
+
+from .utils import generate_terrain, expand_terrain
+
+
+class TerrainCache:
+    """
+    Terrain Cache
+    ==============
+
+    Finished terrain stored as .npy files, keyed by the generation parameters.
+    A file holds two uint8 planes, the terrain levels and the wall mask.
+    Cached terrain is memory-mapped on load, least recently used files are evicted
+    once the cache grows over `max_size` bytes.
+    Terrain without a seed is not reproducible and is never cached.
+    """
+    version = 2
+
+    def __init__(self, directory, max_size=256 * 2**20):
+        self.directory = directory
+        self.max_size = max_size
+
+    def key(self, shape, levels, preset, cave, extra_cave, seed):
+        params = (
+            self.version,
+            tuple(int(n) for n in shape),
+            levels,
+            preset,
+            cave,
+            extra_cave,
+            seed
+        )
+        return hashlib.sha256(repr(params).encode()).hexdigest()[:32]
+
+    def generate_terrain(self, shape, levels, preset="perlin", cave=None, extra_cave=None, seed=None, compact=False):
+        """
+        Load terrain from the cache, generate and store it on a miss.
+        Takes the same parameters as `generate_terrain`.
+        """
+        if seed is None:
+            return generate_terrain(shape, levels, preset, cave, extra_cave, compact=compact)
+        path = os.path.join(self.directory, self.key(shape, levels, preset, cave, extra_cave, seed) + ".npy")
+        try:
+            # Copy-on-write: the terrain can be modified in memory, the file stays intact
+            planes = np.load(path, mmap_mode="c")
+            os.utime(path)
+        except (OSError, ValueError):
+            planes = generate_terrain(shape, levels, preset, cave, extra_cave, seed, compact=True)
+            planes = np.stack(planes).astype(np.uint8)
+            self.store(path, planes)
+        terrain, walls = planes[0], planes[1].view(bool)
+        if compact:
+            return terrain, walls
+        return expand_terrain(terrain, walls)
+
+    def store(self, path, terrain):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, terrain)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used files until the cache fits in `max_size`
+        """
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".npy"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
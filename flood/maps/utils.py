@@ -1,29 +1,97 @@
 import numpy as np
-from perlin_noise import PerlinNoise
-from pyperlin import FractalPerlin2D
-# TODO: custom perlin implementation using only numpy
 
 
-def generate_terrain(shape, levels, preset="perlin", cave=None, extra_cave=None):
+def _fade(t):
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+
+def perlin_noise(shape, frequency, rng):
+    """
+    Single layer of 2D gradient noise for the whole field at once
+    :param shape: Shape of the output array
+    :param frequency: Number of lattice periods across the field
+    :param rng: numpy.random.Generator
+    :return: Array of shape `shape` with values roughly in (-0.7, 0.7)
+    """
+    steps = [np.arange(n) / n * frequency for n in shape]
+    lattice = [int(np.ceil(frequency)) + 1 for _ in shape]
+    angles = rng.random(lattice) * 2 * np.pi
+    gradient_x, gradient_y = np.cos(angles), np.sin(angles)
+
+    x0, y0 = (np.floor(step).astype(int) for step in steps)
+    dx, dy = steps[0] - x0, steps[1] - y0
+    x0, dx = x0[:, None], dx[:, None]
+    y0, dy = y0[None, :], dy[None, :]
+
+    def corner(ox, oy):
+        return gradient_x[x0 + ox, y0 + oy] * (dx - ox) + gradient_y[x0 + ox, y0 + oy] * (dy - oy)
+
+    u, v = _fade(dx), _fade(dy)
+    bottom = corner(0, 0) + u * (corner(1, 0) - corner(0, 0))
+    top = corner(0, 1) + u * (corner(1, 1) - corner(0, 1))
+    return bottom + v * (top - bottom)
+
+
+def fractal_noise(shape, frequency=8, octaves=1, persistence=0.5, lacunarity=2.0, seed=None):
+    """
+    Fractal gradient (Perlin) noise built only on numpy
+    :param shape: Shape of the output array
+    :param frequency: Number of lattice periods across the field in the first octave
+    :param octaves: Number of noise layers
+    :param persistence: Amplitude multiplier between octaves
+    :param lacunarity: Frequency multiplier between octaves
+    :param seed: Seed or numpy.random.Generator
+    :return: Array of shape `shape`
+    """
+    rng = np.random.default_rng(seed)
+    noise = np.zeros(shape)
+    amplitude = 1.
+    for _ in range(octaves):
+        noise += amplitude * perlin_noise(shape, frequency, rng)
+        frequency *= lacunarity
+        amplitude *= persistence
+    return noise
+
+
+def compact_terrain(terrain, dtype=np.uint8):
+    """
+    Integer terrain levels and a wall mask from float terrain with NaN walls
+    :param terrain: Float terrain levels, NaN for walls
+    :param dtype: Integer type of the levels
+    :return: (levels, walls), walls have level 0
+    """
+    walls = np.isnan(terrain)
+    levels = np.where(walls, 0, terrain).astype(dtype)
+    return levels, walls
+
+
+def expand_terrain(levels, walls):
+    """
+    Float terrain with NaN walls from integer levels and a wall mask, the inverse of `compact_terrain`
+    """
+    return np.where(walls, np.nan, levels)
+
+
+def generate_terrain(shape, levels, preset="perlin", cave=None, extra_cave=None, seed=None, compact=False):
+    """
+    Terrain levels from 0 to `levels`
+    :param compact: Return (uint8 levels, boolean wall mask) instead of float levels with NaN walls
+    """
+    rng = np.random.default_rng(seed)
     normalize = True
     if preset == "bumps":
         base = np.tile(np.linspace(0, 2*np.pi, num=shape[0]), (shape[1], 1))
-        noise = np.random.random(shape)
+        noise = rng.random(shape)
         terrain = base*np.sin(2*base) * 1 - base.T+np.cos(1.5*base).T * 3 + noise * 3
     elif preset == "well":
         base = np.tile(np.linspace(0, 2 * np.pi, num=shape[0]), (shape[1], 1))
-        noise = np.random.random(shape)
+        noise = rng.random(shape)
         terrain = base * np.sin(base) - base.T * 3 + noise * 3
         x = shape[0] // 8
         y = shape[1] // 8
         terrain[3*x:5*x, 3*y:5*y] = terrain.min() - 2
     elif preset == "walls":
-        noise_gen = PerlinNoise(octaves=8)
-        terrain = np.reshape([
-            noise_gen([x/shape[0], y/shape[1]])
-            for (x, y)
-            in np.ndindex(shape)
-        ], shape) * 4
+        terrain = fractal_noise(shape, frequency=8, seed=rng) * 4
         x = shape[0] // 8
         y = shape[1] // 8
         terrain[3*x, 3*y:5*y+1] = 5
@@ -35,32 +103,15 @@ def generate_terrain(shape, levels, preset="perlin", cave=None, extra_cave=None)
         terrain[:, 4*y] = 4
         terrain[4*x, :] = 4
     elif preset == "perlin":
-        noise_gen = PerlinNoise(octaves=8)
-        terrain = np.reshape([
-            noise_gen([x/shape[0], y/shape[1]])
-            for (x, y)
-            in np.ndindex(shape)
-        ], shape)
+        terrain = fractal_noise(shape, frequency=8, seed=rng)
     elif preset == "perlin4":
-        resolutions = [(2 ** i, 2 ** i) for i in range(1, 7)]  # for lacunarity = 2.0
-        factors = [.9 ** i for i in range(6)]  # for persistence = 0.5
-        terrain = FractalPerlin2D((1, *shape), resolutions, factors)().cpu().numpy()[0]
-
+        terrain = fractal_noise(shape, frequency=2, octaves=6, persistence=0.9, lacunarity=2.0, seed=rng)
     elif preset == "checker_terrain":
-        noise_gen = PerlinNoise(octaves=3)
-        terrain = np.reshape([
-            noise_gen([x / shape[0], y / shape[1]])
-            for (x, y)
-            in np.ndindex(shape)
-        ], shape)*2
-        noise = np.zeros(shape)
-        for (x, y) in np.ndindex(shape):
-            noise[x, y] = (x+y)%2
-        terrain += noise
+        terrain = fractal_noise(shape, frequency=3, seed=rng) * 2
+        terrain += np.indices(shape).sum(axis=0) % 2
     elif preset == "checker":
         terrain = np.ones(shape) * 2
-        for (x, y) in np.ndindex(shape):
-            terrain[x, y] += (x+y)%2
+        terrain += np.indices(shape).sum(axis=0) % 2
         normalize = False
 
     if normalize:
@@ -71,14 +122,11 @@ def generate_terrain(shape, levels, preset="perlin", cave=None, extra_cave=None)
         terrain = terrain / np.nanmax(terrain) * levels
         terrain = np.floor(terrain)
     if extra_cave:
-        noise_gen = PerlinNoise(octaves=8)
-        cave_profile = np.reshape([
-            noise_gen([x / shape[0], y / shape[1]])
-            for (x, y)
-            in np.ndindex(shape)
-        ], shape)
+        cave_profile = fractal_noise(shape, frequency=8, seed=rng)
         cave_profile -= cave_profile.min()
         cave_profile = cave_profile / cave_profile.max()
         terrain[cave_profile > (1 - extra_cave)] = np.nan
 
+    if compact:
+        return compact_terrain(terrain)
     return terrain
@@ -0,0 +1,113 @@
+import copy
+
+import numpy as np
+
+from . import kernels
+
+
+class WaterBody:
+    """
+    Water Body
+    ===========
+
+    Frontier of one connected body of water: a heap of (priority, level, cell) entries
+    in flat buffers, its state (size, position in `random`, empty flag, touch flag, skipped pops)
+    and the random numbers its new entries consume, drawn from its own random state.
+    Buffers are numpy arrays for the compiled kernel, Python lists are faster for the pure Python one.
+    """
+    def __init__(self, root, jit, rng):
+        self.root = root
+        self.jit = jit
+        self.rng = rng
+        self.priority = self._buffer(0, float)
+        self.level = self._buffer(0, np.int64)
+        self.index = self._buffer(0, np.int64)
+        self.state = self._buffer(5, np.int64)
+        self.random = self._buffer(0, float)
+        # Bounding box (min row, min col, max row, max col) of the cells that got water
+        self.bounds = None
+
+    def __len__(self):
+        return int(self.state[kernels.SIZE])
+
+    def _buffer(self, size, dtype):
+        return np.zeros(size, dtype=dtype) if self.jit else [dtype(0)] * size
+
+    def reserve(self, n_entries):
+        """
+        Make room for `n_entries` new frontier entries and random numbers
+        """
+        size = self.state[kernels.SIZE]
+        capacity = len(self.priority)
+        if capacity - size < n_entries:
+            capacity = max(2 * capacity, size + n_entries, 1024)
+            if self.jit:
+                self.priority = np.resize(self.priority, capacity)
+                self.level = np.resize(self.level, capacity)
+                self.index = np.resize(self.index, capacity)
+            else:
+                for buffer in (self.priority, self.level, self.index):
+                    buffer.extend([0] * (capacity - len(buffer)))
+        position = self.state[kernels.RANDOM_POS]
+        if len(self.random) - position < n_entries:
+            random = self.rng.random(max(n_entries, 4096))
+            if self.jit:
+                self.random = np.concatenate((self.random[position:], random))
+            else:
+                self.random = self.random[position:] + random.tolist()
+            self.state[kernels.RANDOM_POS] = 0
+
+    def grow_bounds(self, rows, cols):
+        bounds = (rows.min(), cols.min(), rows.max(), cols.max())
+        if self.bounds is None:
+            self.bounds = bounds
+        else:
+            self.bounds = (
+                min(self.bounds[0], bounds[0]),
+                min(self.bounds[1], bounds[1]),
+                max(self.bounds[2], bounds[2]),
+                max(self.bounds[3], bounds[3]),
+            )
+
+    def gap(self, other):
+        """
+        Number of cells between the bounding boxes of two bodies along the more distant axis
+        """
+        if self.bounds is None or other.bounds is None:
+            return np.inf
+        return max(
+            other.bounds[0] - self.bounds[2],
+            self.bounds[0] - other.bounds[2],
+            other.bounds[1] - self.bounds[3],
+            self.bounds[1] - other.bounds[3],
+        ) - 1
+
+    def merge(self, other):
+        """
+        Take over the frontier of another body. Sorted entries form a valid heap.
+        """
+        size, other_size = len(self), len(other)
+        entries = [
+            np.concatenate((np.asarray(mine[:size]), np.asarray(theirs[:other_size])))
+            for mine, theirs in (
+                (self.priority, other.priority),
+                (self.level, other.level),
+                (self.index, other.index)
+            )
+        ]
+        order = np.lexsort(entries[::-1])
+        self.priority, self.level, self.index = (
+            buffer[order] if self.jit else buffer[order].tolist()
+            for buffer in entries
+        )
+        self.state[kernels.SIZE] = size + other_size
+        self.state[kernels.SKIPPED] += other.state[kernels.SKIPPED]
+        if other.bounds is not None:
+            self.grow_bounds(np.array(other.bounds[::2]), np.array(other.bounds[1::2]))
+
+    def copy(self):
+        body = copy.copy(self)
+        for name in ("priority", "level", "index", "state", "random"):
+            setattr(body, name, copy.copy(getattr(self, name)))
+        body.rng = copy.deepcopy(self.rng)
+        return body
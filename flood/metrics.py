@@ -0,0 +1,152 @@
+"""
+Metrics
+========
+
+Timings of the phases of a frame, kept in rolling windows and summarized as percentiles,
+and counters sampled from the game. Reports are shown in an overlay and dumped periodically
+to a JSON file (latest report) or a CSV file (one row per report).
+Disabled metrics return right away from every call, the game loop pays a method call per phase.
+"""
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+
+class Metrics:
+    percentiles = (50, 95, 99)
+
+    def __init__(self, window=240, enabled=False, dump_path=None, dump_interval=5.0):
+        """
+        :param window: Number of samples per rolling window
+        :param enabled: Collect timings
+        :param dump_path: .json or .csv file to dump reports into, None for no dump
+        :param dump_interval: Seconds between dumps
+        """
+        self.window = window
+        self.enabled = enabled
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.overlay = False
+        # Rolling windows by name, and the number of samples ever recorded
+        self._samples = {}
+        self._recorded = {}
+        self._lap_start = None
+        # (time, value) of running totals at the previous report, for rates
+        self._totals = {}
+        self._last_dump = time.monotonic()
+
+    def toggle_overlay(self):
+        """
+        Show or hide the overlay, showing it enables the metrics
+        """
+        self.overlay = not self.overlay
+        if self.overlay:
+            self.enabled = True
+
+    def start(self):
+        """
+        Start timing a frame
+        """
+        if not self.enabled:
+            return
+        self._lap_start = time.perf_counter()
+
+    def lap(self, name):
+        """
+        Record the time since the previous lap (or `start`) as phase `name`
+        """
+        if not self.enabled or self._lap_start is None:
+            return
+        now = time.perf_counter()
+        self.record(name, now - self._lap_start)
+        self._lap_start = now
+
+    def record(self, name, value):
+        """
+        Add a sample to the rolling window `name`
+        """
+        samples = self._samples.get(name)
+        if samples is None:
+            samples = self._samples[name] = np.zeros(self.window)
+            self._recorded[name] = 0
+        samples[self._recorded[name] % self.window] = value
+        self._recorded[name] += 1
+
+    def summary(self, name):
+        """
+        :return: Dict of the mean and the percentiles of a rolling window
+        """
+        samples = self._samples[name][:min(self._recorded[name], self.window)]
+        summary = {"mean": float(samples.mean())}
+        for q, value in zip(self.percentiles, np.percentile(samples, self.percentiles)):
+            summary[f"p{q}"] = float(value)
+        return summary
+
+    def rate(self, name, total, now=None):
+        """
+        Per-second rate of a running total since the previous call with the same name
+        """
+        now = time.monotonic() if now is None else now
+        last = self._totals.get(name)
+        self._totals[name] = (now, total)
+        if last is None or now <= last[0]:
+            return 0.0
+        return (total - last[1]) / (now - last[0])
+
+    def report(self, counters):
+        """
+        :param counters: Dict of counter values sampled by the caller
+        :return: Dict with the summaries of the timed phases (ms) and the counters
+        """
+        return {
+            "time": time.time(),
+            "phases": {
+                name: {key: 1000 * value for key, value in self.summary(name).items()}
+                for name in self._samples
+            },
+            "counters": counters,
+        }
+
+    def dump_due(self):
+        return self.dump_path is not None and time.monotonic() - self._last_dump >= self.dump_interval
+
+    def dump(self, report):
+        """
+        Write a report, replacing the JSON file or appending a row to the CSV file
+        """
+        self._last_dump = time.monotonic()
+        if str(self.dump_path).endswith(".csv"):
+            row = {"time": report["time"]}
+            for phase, summary in report["phases"].items():
+                for key, value in summary.items():
+                    row[f"{phase} {key} ms"] = value
+            row.update(report["counters"])
+            new = not os.path.exists(self.dump_path)
+            with open(self.dump_path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(row))
+                if new:
+                    writer.writeheader()
+                writer.writerow(row)
+        else:
+            tmp_path = f"{self.dump_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(report, f, indent=2)
+            os.replace(tmp_path, self.dump_path)
+
+    @staticmethod
+    def format(report):
+        """
+        :return: Lines of text for the overlay
+        """
+        lines = [
+            f"{name:<18}{summary['p50']:7.2f}{summary['p95']:7.2f}{summary['p99']:7.2f} ms"
+            for name, summary in report["phases"].items()
+        ]
+        lines += [
+            f"{name:<18}{value:>21.0f}" if isinstance(value, (int, float)) else f"{name:<18}{value}"
+            for name, value in report["counters"].items()
+        ]
+        return [f"{'phase':<18}{'p50':>7}{'p95':>7}{'p99':>7}"] + lines
@@ -1,124 +1,17 @@
-import abc
-
 import numpy as np
+import pygame as pg
 from OpenGL.GL import *
 
-
-class SpriteABC(abc.ABC):
-    terrain_range = None
-    water_range = None
-
-    @classmethod
-    def configure(cls, terrain_range=None):
-        if terrain_range is not None:
-            cls.terrain_range = terrain_range
-            cls.water_range = terrain_range + 2
-
-    @classmethod
-    def draw(cls, *args, **kwargs):
-        raise NotImplementedError()
-
-
-class Ground(SpriteABC):
-    color = np.array((0.5, 0.45, 0.45))
-    padding = 0.1
-    vertices = [
-        (padding, padding),
-        (1 - padding, padding),
-        (1 - padding, 1 - padding),
-        (padding, 1 - padding)
-    ]
-
-    @classmethod
-    def configure(cls, padding=None):
-        if padding is not None:
-            cls.padding = padding
-
-    @classmethod
-    def draw(cls, *, terrain_level):
-        glPolygonMode(GL_FRONT, GL_FILL)
-        glColor3f(*(cls.color * terrain_level))
-        glBegin(GL_QUADS)
-        for pair in cls.vertices:
-            glVertex2fv(pair)
-        glEnd()
-
-
-class Player(SpriteABC):
-    color = np.array((1, 1, 1))
-    vertices = [
-        (0.5, 0),
-        (1, 0.5),
-        (0.5, 1),
-        (0, 0.5)
-    ]
-
-    @classmethod
-    def draw(cls):
-        glPolygonMode(GL_FRONT, GL_FILL)
-        glColor3f(*cls.color)
-        glBegin(GL_QUADS)
-        for pair in cls.vertices:
-            glVertex2fv(pair)
-        glEnd()
-
-
-class Water(SpriteABC):
-    color = np.array((0.3, 0.4, 1))
-    vertices = [
-        (0, 0),
-        (1, 0),
-        (1, 1),
-        (0, 1)
-    ]
-
-    @classmethod
-    def draw(cls, *, water_level):
-        glPolygonMode(GL_FRONT, GL_FILL)
-        # glColor3f(*(cls.color_water * water_level / cls.terrain_range))
-        glColor3f(*(cls.color[:2] * (1 - water_level)), np.cos(water_level * np.pi / 2))
-        glBegin(GL_QUADS)
-        for pair in cls.vertices:
-            glVertex2fv(pair)
-        glEnd()
-
-
-class Wave(SpriteABC):
-    color = np.array((0.7, 0.7, 1))
-    vertices = [
-        (0, 0.35),
-        (0.7, 0.15),
-        (0.3, 0.85),
-        (1, 0.65)
-    ]
-
-    @classmethod
-    def draw(cls, *, total_level):
-        glPolygonMode(GL_FRONT, GL_FILL)
-        glColor3f(*(cls.color * total_level))
-        glBegin(GL_LINES)
-        for pair in cls.vertices:
-            glVertex2fv(pair)
-        glEnd()
-
-
-class WaterSource(SpriteABC):
-    color = np.array((.6, .6, 1.))
-    vertices = [
-        (0., 0.),
-        (0.5, 0.3),
-        (1.0, 0.),
-        (0.5, 1.0),
-    ]
-
-    @classmethod
-    def draw(cls):
-        glPolygonMode(GL_FRONT, GL_FILL)
-        glColor3f(*cls.color)
-        glBegin(GL_QUADS)
-        for pair in cls.vertices:
-            glVertex2fv(pair)
-        glEnd()
+from .geometry import (
+    Ground,
+    Player,
+    Npc,
+    Water,
+    Wave,
+    WaterSource,
+    GridLayers,
+    ChunkedLayers,
+)
 
 
 class Renderer:
@@ -130,12 +23,171 @@ class Renderer:
             "water_wave": Wave,
             "water_source": WaterSource,
             "player": Player,
+            "npc": Npc,
+        }
+        self.primitives = {
+            "quads": GL_QUADS,
+            "lines": GL_LINES,
         }
+        # (layers, vertex buffers, vertex count) by (id of the GridLayers, layer name)
+        self._buffers = {}
+        # ChunkedLayers whose chunks own the buffers
+        self._chunked = None
+        # GL draw calls since the last reset, see Game.draw
+        self.draw_calls = 0
+        self._font = None
+        # (lines, RGBA bytes, size) of the last drawn text
+        self._text = None
 
     def draw(self, t, coords, what, **kwargs):
+        sprite = self.objects[what]
         glPolygonMode(GL_FRONT, GL_FILL)
         glPushMatrix()
         glScale(self.scale, self.scale, 1)
         glTranslate(*coords, 0)
-        self.objects[what].draw(**kwargs)
+        glColor3f(*sprite.colors(**kwargs))
+        glBegin(self.primitives[sprite.primitive])
+        for pair in sprite.vertices:
+            glVertex2fv(pair)
+        glEnd()
+        glPopMatrix()
+        self.draw_calls += 1
+
+    def draw_layers(self, t, layers):
+        """
+        Draw batched sprite layers, one array draw call per layer
+        :param t: Current time in seconds
+        :param layers: Dict mapping sprite names to (vertices, colors) arrays
+        """
+        glPolygonMode(GL_FRONT, GL_FILL)
+        glPushMatrix()
+        glScale(self.scale, self.scale, 1)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        for what, (vertices, colors) in layers.items():
+            if len(vertices) == 0:
+                continue
+            glVertexPointer(2, GL_FLOAT, 0, vertices)
+            glColorPointer(3, GL_FLOAT, 0, colors)
+            glDrawArrays(self.primitives[self.objects[what].primitive], 0, len(vertices))
+            self.draw_calls += 1
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
         glPopMatrix()
+
+    def draw_cached_layers(self, t, layers: GridLayers):
+        """
+        Draw persistent grid layers from vertex buffer objects,
+        uploading only the vertex ranges that changed since the last frame
+        :param t: Current time in seconds
+        :param layers: GridLayers
+        """
+        glPolygonMode(GL_FRONT, GL_FILL)
+        glPushMatrix()
+        glScale(self.scale, self.scale, 1)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        for what, (vertices, colors) in layers.items():
+            if len(vertices) == 0:
+                continue
+            buffers = self._get_buffers(layers, what)
+            glBindBuffer(GL_ARRAY_BUFFER, buffers[0])
+            glVertexPointer(2, GL_FLOAT, 0, None)
+            glBindBuffer(GL_ARRAY_BUFFER, buffers[1])
+            glColorPointer(3, GL_FLOAT, 0, None)
+            glDrawArrays(self.primitives[self.objects[what].primitive], 0, len(vertices))
+            self.draw_calls += 1
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glPopMatrix()
+
+    def draw_chunked_layers(self, t, layers: ChunkedLayers, view=None):
+        """
+        Draw the chunks of chunked grid layers that overlap the view
+        :param t: Current time in seconds
+        :param layers: ChunkedLayers
+        :param view: (first row, first column, stop row, stop column) in cells (default the whole grid)
+        """
+        if layers is not self._chunked:
+            # the grid got new layers, e.g. on Game.load, the buffers of the old chunks are stale
+            self.release(keep=layers.chunks.values())
+            self._chunked = layers
+        for chunk in layers.visible(view):
+            self.draw_cached_layers(t, layers.get(chunk))
+
+    def draw_text(self, lines, position=(8, 8)):
+        """
+        Draw lines of white monospace text on black, the image is rebuilt only when the text changes
+        :param lines: List of strings
+        :param position: Top left corner in window pixels from the top left of the window
+        """
+        if self._text is None or self._text[0] != lines:
+            if self._font is None:
+                pg.font.init()
+                self._font = pg.font.SysFont("monospace", 14)
+            rendered = [self._font.render(line, True, (255, 255, 255), (0, 0, 0)) for line in lines]
+            surface = pg.Surface((
+                max((line.get_width() for line in rendered), default=1),
+                max(sum(line.get_height() for line in rendered), 1)
+            ))
+            y = 0
+            for line in rendered:
+                surface.blit(line, (0, y))
+                y += line.get_height()
+            self._text = (list(lines), pg.image.tobytes(surface, "RGBA", True), surface.get_size())
+        _, data, (width, height) = self._text
+        window_height = glGetIntegerv(GL_VIEWPORT)[3]
+        glWindowPos2i(position[0], window_height - position[1] - height)
+        glDrawPixels(width, height, GL_RGBA, GL_UNSIGNED_BYTE, data)
+        self.draw_calls += 1
+
+    def draw_image(self, image, position=(8, 8), zoom=1):
+        """
+        Draw an RGB image in a single call
+        :param image: uint8 array of shape (height, width, 3), top row first
+        :param position: Top left corner in window pixels from the top left of the window
+        :param zoom: Window pixels per image pixel
+        """
+        height, width = image.shape[:2]
+        window_height = glGetIntegerv(GL_VIEWPORT)[3]
+        glWindowPos2i(int(position[0]), int(window_height - position[1] - height * zoom))
+        glPixelZoom(zoom, zoom)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        glDrawPixels(width, height, GL_RGB, GL_UNSIGNED_BYTE, np.ascontiguousarray(image[::-1]))
+        glPixelZoom(1, 1)
+        self.draw_calls += 1
+
+    def release(self, keep=()):
+        """
+        Delete the vertex buffers of all cached layers except `keep`
+        :param keep: Iterable of GridLayers whose buffers stay
+        """
+        keep = {id(layers) for layers in keep}
+        for key in [key for key in self._buffers if key[0] not in keep]:
+            _, buffers, _ = self._buffers.pop(key)
+            glDeleteBuffers(len(buffers), buffers)
+
+    def _get_buffers(self, layers, what):
+        """
+        Vertex buffers of a layer, created or patched to match its current content
+        """
+        vertices, colors = layers[what]
+        owner, buffers, size = self._buffers.get((id(layers), what), (None, None, 0))
+        modified = layers.take_modified(what)
+        if owner is not layers or size != len(vertices):
+            modified = None
+        if buffers is None:
+            buffers = glGenBuffers(2)
+        if modified is None:
+            for buffer, data in zip(buffers, (vertices, colors)):
+                glBindBuffer(GL_ARRAY_BUFFER, buffer)
+                glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_DYNAMIC_DRAW)
+            self._buffers[id(layers), what] = (layers, buffers, len(vertices))
+            return buffers
+        for start, stop in modified:
+            for buffer, data in zip(buffers, (vertices, colors)):
+                chunk = data[start:stop]
+                glBindBuffer(GL_ARRAY_BUFFER, buffer)
+                glBufferSubData(GL_ARRAY_BUFFER, start * data.itemsize * data.shape[1], chunk.nbytes, chunk)
+        return buffers
@@ -0,0 +1,82 @@
+"""
+Snapshots
+==========
+
+Versioned binary files holding a JSON header and raw array payloads.
+
+    magic (8 bytes) | version (uint32) | header length (uint32) | JSON header | arrays
+
+Every array starts at a 64-byte aligned offset, so a whole snapshot is memory-mapped
+with a single call on load and every array is a view of the mapping.
+"""
+import json
+import os
+
+import numpy as np
+
+MAGIC = b"FLOODSNP"
+VERSION = 2
+ALIGNMENT = 64
+
+
+def _align(n):
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(path, meta, arrays):
+    """
+    Write a snapshot atomically
+    :param path: Output file
+    :param meta: JSON-serializable dict
+    :param arrays: Dict of numpy arrays by name
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    index = {}
+    offset = 0
+    for name, array in arrays.items():
+        index[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({"meta": meta, "arrays": index}, separators=(",", ":")).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.array([VERSION, len(header)], dtype="<u4").tobytes())
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + index[name]["offset"])
+            f.write(memoryview(array).cast("B"))
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path, mmap=True):
+    """
+    Read a snapshot
+    :param path: Snapshot file
+    :param mmap: Map the arrays copy-on-write instead of reading them into memory
+    :return: (meta, arrays)
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a snapshot")
+        version, header_length = np.frombuffer(f.read(8), dtype="<u4")
+        if version != VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}")
+        header = json.loads(f.read(int(header_length)))
+        data_start = _align(len(MAGIC) + 8 + int(header_length))
+        if mmap:
+            data = np.memmap(f, dtype=np.uint8, mode="c")
+        else:
+            f.seek(0)
+            data = np.frombuffer(bytearray(f.read()), dtype=np.uint8)
+
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        start = data_start + entry["offset"]
+        size = int(np.prod(entry["shape"], dtype=np.int64)) * dtype.itemsize
+        # A plain ndarray view, so that the arrays can be handed to compiled kernels
+        arrays[name] = np.asarray(data[start:start + size]).view(dtype).reshape(entry["shape"])
+    return header["meta"], arrays
@@ -0,0 +1,178 @@
+"""
+Simulation worker
+==================
+
+Runs the water grid on a background thread, so that input and drawing keep the frame rate
+however long a round takes. Completed rounds are published into two alternating buffers:
+the worker only writes the back buffer, and only after the reader has taken the current front,
+so the reader draws without locks. The changed cells of every snapshot are kept until `draw` has
+applied them, so drawing stays complete when a snapshot is acquired elsewhere or skipped.
+"""
+import queue
+from collections import deque
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+from .abc import DrawableABC
+from .geometry import ChunkedLayers
+from .maps import Overview
+
+
+class Snapshot(NamedTuple):
+    sequence: int
+    round: int
+    # Water levels, read-only for the reader
+    water: np.ndarray
+    # Flat indices of the cells changed since the previous snapshot
+    changed: np.ndarray
+    sources: frozenset
+
+
+class SimulationWorker(DrawableABC):
+    # Seconds between attempts to publish rounds completed while the reader was busy
+    publish_interval = 0.005
+
+    def __init__(self, grid):
+        self.grid = grid
+        self._buffers = [grid.water_grid.copy(), grid.water_grid.copy()]
+        # Changed cells not yet copied into each buffer
+        self._pending = [[], []]
+        # Changed cells since the last snapshot
+        self._changed = []
+        # (sequence, changed cells) of the snapshots published since the last draw
+        self._deltas = deque()
+        self._front = 0
+        self.front = Snapshot(0, grid.round, self._buffers[0], np.zeros(0, dtype=np.intp), frozenset(grid._sources))
+        self._acquired = 0
+        # Set when a completed round could not be published yet
+        self._stale = False
+        self._tasks = queue.Queue()
+        self.layers = None
+        self.overview = None
+        self._drawn = -1
+        self._thread = threading.Thread(target=self._work, name="simulation", daemon=True)
+        self._thread.start()
+
+    def call(self, func, *args):
+        """
+        Run `func(*args)` on the worker thread, after the tasks submitted before it
+        """
+        self._tasks.put((func, args))
+
+    def submit(self, r):
+        """
+        Queue a simulation round
+        """
+        self.call(self.grid.step_update, r, None)
+
+    @property
+    def busy(self):
+        return self._tasks.unfinished_tasks > 0
+
+    def wait(self):
+        """
+        Block until all submitted tasks are done, the grid can then be read from any thread
+        """
+        self._tasks.join()
+
+    def stop(self):
+        self._tasks.put(None)
+        self._thread.join()
+
+    def acquire(self):
+        """
+        Latest published snapshot. The reader may use it until its next call.
+        """
+        snapshot = self.front
+        self._acquired = snapshot.sequence
+        return snapshot
+
+    def _work(self):
+        while True:
+            try:
+                task = self._tasks.get(timeout=self.publish_interval if self._stale else None)
+            except queue.Empty:
+                self._publish()
+                continue
+            if task is None:
+                self._tasks.task_done()
+                return
+            func, args = task
+            try:
+                func(*args)
+            finally:
+                if self.grid._dirty:
+                    changed = np.fromiter(self.grid._dirty, dtype=np.intp)
+                    self.grid._dirty.clear()
+                    self._changed.append(changed)
+                    self._pending[0].append(changed)
+                    self._pending[1].append(changed)
+                self._publish()
+                self._tasks.task_done()
+
+    def _publish(self):
+        sources = frozenset(self.grid._sources)
+        if not self._changed and sources == self.front.sources and self.grid.round == self.front.round:
+            return
+        if self._acquired != self.front.sequence:
+            # The reader may still be drawing the back buffer
+            self._stale = True
+            return
+        self._stale = False
+        back = 1 - self._front
+        if self._pending[back]:
+            cells = np.concatenate(self._pending[back])
+            self._buffers[back].flat[cells] = self.grid.water_grid.flat[cells]
+            self._pending[back] = []
+        changed = np.concatenate(self._changed) if self._changed else np.zeros(0, dtype=np.intp)
+        self._changed = []
+        self._front = back
+        self._deltas.append((self.front.sequence + 1, changed))
+        self.front = Snapshot(self.front.sequence + 1, self.grid.round, self._buffers[back], changed, sources)
+
+    def _undrawn(self, sequence):
+        """
+        Take the changed cells of the snapshots up to `sequence` that were not drawn yet.
+        The worker may publish the next snapshot meanwhile, its cells stay for the next draw.
+        """
+        deltas = []
+        while self._deltas and self._deltas[0][0] <= sequence:
+            deltas.append(self._deltas.popleft()[1])
+        return np.concatenate(deltas) if deltas else np.zeros(0, dtype=np.intp)
+
+    def draw(self, t, renderer, view=None, **kwargs):
+        """
+        Draw the latest published round, and bring `overview` up to it
+        :param view: (first row, first column, stop row, stop column) of the visible cells (default all)
+        """
+        snapshot = self.acquire()
+        if self.layers is None:
+            self.layers = ChunkedLayers(
+                self.grid.terrain_grid,
+                snapshot.water,
+                snapshot.sources,
+                self.grid.terrain_levels,
+                self.grid.water_levels,
+                chunk_size=self.grid.chunk_size,
+                walls=self.grid.walls
+            )
+            self.overview = Overview(
+                self.grid.terrain_grid,
+                self.grid.walls,
+                self.grid.terrain_levels,
+                self.grid.water_levels,
+                block=self.grid.overview_block
+            )
+            self.overview.refresh(snapshot.water)
+            self._undrawn(snapshot.sequence)
+            self._drawn = snapshot.sequence
+        if snapshot.sequence != self._drawn:
+            if snapshot.sources != self.layers.sources:
+                self.layers.set_sources(snapshot.sources, snapshot.water)
+            changed = self._undrawn(snapshot.sequence)
+            self.layers.update(snapshot.water, changed)
+            self.overview.refresh(snapshot.water, changed)
+            self._drawn = snapshot.sequence
+        renderer.draw_chunked_layers(t, self.layers, view)
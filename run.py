@@ -1,5 +1,29 @@
-from flood import Game
+import argparse
+import time
+
+from flood import Game, controls
 
 if __name__ == "__main__":
-    game = Game("settings.yml")
-    game.run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="settings.yml")
+    parser.add_argument("--record", metavar="PATH", help="Record the rounds of the session")
+    parser.add_argument("--replay", metavar="PATH", help="Play a recording back headless, at full speed")
+    args = parser.parse_args()
+
+    if args.replay:
+        recording = controls.Recording.load(args.replay)
+        game = Game(args.config, controller=controls.ReplayController(recording), seed=recording.seed, headless=True)
+        start = time.perf_counter()
+        game.run()
+        print(f"Replayed {game.round} rounds in {time.perf_counter() - start:.2f}s")
+    elif args.record:
+        game = Game(args.config)
+        recording = controls.Recording(game.seed)
+        game.controller = controls.RecordingController(game.controller, recording)
+        try:
+            game.run()
+        finally:
+            recording.save(args.record)
+    else:
+        game = Game(args.config)
+        game.run()
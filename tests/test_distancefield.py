@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from flood.maps import DistanceField
+
+
+@pytest.fixture(params=[True, False], ids=["jit", "python"])
+def jit(request):
+    return request.param
+
+
+def make_map():
+    # a room with a wall down the middle, open at the bottom, water in the top left corner
+    walls = np.zeros((16, 16), dtype=bool)
+    walls[:12, 8] = True
+    water = np.zeros((16, 16), dtype=np.uint8)
+    water[:3, :3] = 2
+    return np.ones((16, 16), dtype=np.uint8), walls, water
+
+
+def test_flee_map_is_finite_on_reachable_floor(jit):
+    terrain, walls, water = make_map()
+    field = DistanceField(terrain, walls, from_water=True, flee=1.2, jit=jit)
+    field.refresh(water)
+    assert np.isfinite(field.distance[~walls]).all()
+    assert np.isinf(field.distance[walls]).all()
+
+
+def test_downhill_flees_the_water(jit):
+    terrain, walls, water = make_map()
+    to_water = DistanceField(terrain, walls, from_water=True, jit=jit)
+    flee = DistanceField(terrain, walls, from_water=True, flee=1.2, jit=jit)
+    to_water.refresh(water)
+    flee.refresh(water)
+    positions = np.array([(4, 4), (3, 1), (10, 6), (14, 2)])
+    moved = flee.downhill(positions)
+    assert (np.abs(moved - positions).sum(axis=1) == 1).all()
+    assert (to_water.values(moved) > to_water.values(positions)).all()
+
+
+def test_water_field_goes_stale_only_when_cells_get_wet(jit):
+    terrain, walls, water = make_map()
+    field = DistanceField(terrain, walls, from_water=True, flee=1.2, jit=jit)
+    field.refresh(water)
+    field.distance
+    field.refresh(water, np.zeros(0, dtype=np.intp))
+    assert not field.stale
+    water[1, 1] += 1
+    field.refresh(water, [1 * 16 + 1])
+    assert not field.stale
+    water[5, 5] = 1
+    field.refresh(water, [5 * 16 + 5])
+    assert field.stale
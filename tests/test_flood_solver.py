@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from flood.maps import FrExWaterGrid, generate_terrain
+
+
+@pytest.fixture(params=[True, False], ids=["jit", "python"])
+def jit(request):
+    return request.param
+
+
+def make_grid(size, seed, jit):
+    shape = (size, size)
+    grid = FrExWaterGrid(shape=shape, depth_first_factor=5, verbose=False, jit=jit, seed=seed)
+    grid.set_terrain(*generate_terrain(shape, 8, "perlin", cave=0.3, extra_cave=0.2, seed=seed, compact=True))
+    floor = np.argwhere(~grid.walls)
+    for i in np.random.default_rng(seed).choice(len(floor), size=2, replace=False):
+        grid.add_source(tuple(int(c) for c in floor[i]))
+    return grid
+
+
+def simulate(grid):
+    # step until the frontier is empty, recording the round each cell first got water
+    arrival = np.full(grid.shape, np.inf)
+    arrival[grid.water_grid > 0] = grid.round
+    r = grid.round
+    while grid.frontier_size:
+        r += 1
+        grid.step_update(r, None)
+        arrival[(grid.water_grid > 0) & np.isinf(arrival)] = r
+    arrival[grid.walls] = np.nan
+    return arrival, np.where(grid.walls, np.nan, grid.water_grid.astype(int) + grid.terrain_grid)
+
+
+@pytest.mark.parametrize("size", [16, 32])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_solve_flood_matches_simulation(size, seed, jit):
+    grid = make_grid(size, seed, jit)
+    grid.fast_forward(seed * 10)
+    arrival, level = grid.solve_flood()
+    expected_arrival, expected_level = simulate(grid)
+    np.testing.assert_array_equal(arrival, expected_arrival)
+    np.testing.assert_array_equal(level, expected_level)
+    assert np.isfinite(arrival).any()
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from flood.maps import FrExWaterGrid, generate_terrain, kernels
+
+
+def make_grid(jit, seed=3, size=32, n_sources=4):
+    shape = (size, size)
+    grid = FrExWaterGrid(shape=shape, depth_first_factor=5, verbose=False, jit=jit, seed=seed)
+    grid.set_terrain(*generate_terrain(shape, 8, "perlin", cave=0.3, extra_cave=0.2, seed=seed, compact=True))
+    floor = np.argwhere(~grid.walls)
+    for i in np.random.default_rng(seed).choice(len(floor), size=n_sources, replace=False):
+        grid.add_source(tuple(int(c) for c in floor[i]))
+    return grid
+
+
+@pytest.mark.skipif(not kernels.numba_available(), reason="numba is not installed")
+@pytest.mark.parametrize("seed", [3, 4])
+def test_jit_matches_python(seed):
+    jitted, python = make_grid(True, seed), make_grid(False, seed)
+    assert jitted.jit and not python.jit
+    bodies = []
+    for r in range(1, 200):
+        jitted.step_update(r, None)
+        python.step_update(r, None)
+        np.testing.assert_array_equal(jitted.water_grid, python.water_grid, err_msg=f"round {r}")
+        assert jitted.total_steps == python.total_steps
+        bodies.append(len(jitted.bodies))
+    # the sources start several bodies that merge as they grow
+    assert bodies[0] > 1 and bodies[-1] < bodies[0]
+    assert len(python.bodies) == bodies[-1]
+
+
+@pytest.mark.parametrize("jit", [True, False], ids=["jit", "python"])
+@pytest.mark.parametrize("n_rounds", [1, 30, 199])
+def test_fast_forward_matches_step_update(jit, n_rounds):
+    stepped, forwarded = make_grid(jit), make_grid(jit)
+    for r in range(1, n_rounds + 1):
+        stepped.step_update(r, None)
+    forwarded.fast_forward(n_rounds)
+    assert forwarded.round == stepped.round == n_rounds
+    np.testing.assert_array_equal(forwarded.water_grid, stepped.water_grid)
+    assert forwarded.total_steps == stepped.total_steps
+    assert forwarded.frontier_size == stepped.frontier_size